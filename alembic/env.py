@@ -2,6 +2,7 @@ from decouple import config as env
 
 from app.config.database import Base
 from app.models.base import BaseModel
+from app.models.ingredient import Ingredient
 from app.models.recipe import Recipe
 from app.models.user import User
 
@@ -30,6 +31,14 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+# created by hand in the full text search migration and intentionally left
+# off the models, autogenerate would otherwise try to drop them
+UNMANAGED_OBJECTS = {'search_vector', 'ix_recipe_search_vector', 'ix_recipe_name_trgm'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and name in UNMANAGED_OBJECTS)
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -52,6 +61,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -75,7 +85,9 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object
         )
 
         with context.begin_transaction():
@@ -0,0 +1,54 @@
+"""Added recipe full text search
+
+Revision ID: 8f2a61c4d0e7
+Revises: 3c9d5e2a7b41
+Create Date: 2026-10-18 11:40:27.903514
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2a61c4d0e7'
+down_revision: Union[str, None] = '3c9d5e2a7b41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # tsvector, GIN and pg_trgm are Postgres only, other backends search
+    # through the in-process index in app/utils/search.py
+    if op.get_context().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(
+        """
+        ALTER TABLE recipe ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(ingredients, '')), 'B')
+        ) STORED
+        """
+    )
+    op.create_index(
+        'ix_recipe_search_vector', 'recipe', ['search_vector'],
+        unique=False, postgresql_using='gin'
+    )
+    op.create_index(
+        'ix_recipe_name_trgm', 'recipe', ['name'],
+        unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_recipe_name_trgm', table_name='recipe')
+    op.drop_index('ix_recipe_search_vector', table_name='recipe')
+    op.drop_column('recipe', 'search_vector')
@@ -0,0 +1,35 @@
+"""Dropped duplicate id indexes
+
+Revision ID: a3f9c2e61b57
+Revises: 7e3b58c1a9d4
+Create Date: 2026-10-18 12:45:03.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f9c2e61b57'
+down_revision: Union[str, None] = '7e3b58c1a9d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# each duplicates its table's primary key index
+INDEXES = {
+    'ix_recipe_id': 'recipe',
+    'ix_users_id': 'users',
+    'ix_ingredient_id': 'ingredient',
+}
+
+
+def upgrade() -> None:
+    for index, table in INDEXES.items():
+        op.drop_index(op.f(index), table_name=table)
+
+
+def downgrade() -> None:
+    for index, table in INDEXES.items():
+        op.create_index(op.f(index), table, ['id'], unique=True)
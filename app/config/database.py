@@ -1,22 +1,255 @@
-from decouple import config
+import asyncio, itertools, logging, time
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-from sqlalchemy import create_engine
+from decouple import Csv, config
+
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URI = config('DB_URI')
+# comma separated, reads are spread over them, see ReplicaRouter
+DB_REPLICA_URIS = config('DB_REPLICA_URIS', default='', cast=Csv())
+
+DB_ECHO = config('DB_ECHO', default=False, cast=bool)
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+DB_MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=10, cast=int)
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=30, cast=float)
+DB_POOL_RECYCLE = config('DB_POOL_RECYCLE', default=1800, cast=int)
+DB_POOL_PRE_PING = config('DB_POOL_PRE_PING', default=True, cast=bool)
+# milliseconds, 0 disables the timeout
+DB_STATEMENT_TIMEOUT = config('DB_STATEMENT_TIMEOUT', default=30000, cast=int)
+# seconds a replica may trail the primary before reads stop going to it
+DB_REPLICA_MAX_LAG = config('DB_REPLICA_MAX_LAG', default=2.0, cast=float)
+DB_REPLICA_CHECK_INTERVAL = config('DB_REPLICA_CHECK_INTERVAL', default=5.0, cast=float)
+# seconds after a write during which the writer's reads, and rebuilds of the
+# cache entries it changed, stay on the primary. Keep it above
+# DB_REPLICA_MAX_LAG so the write is on the replicas by the time they are used
+DB_READ_YOUR_WRITES_WINDOW = config('DB_READ_YOUR_WRITES_WINDOW', default=5.0, cast=float)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+def async_database_uri(uri: str) -> str:
+    # DB_URI is shared with alembic, which runs on the sync driver, so the
+    # async driver is swapped in here rather than configured separately
+    url = make_url(uri)
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'Unsupported database backend, {backend}')
+
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        self.checkouts += 1
+        self.timeouts += timed_out
+        self.wait_time_total += seconds
+        self.wait_time_max = max(self.wait_time_max, seconds)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # _do_get is where a checkout blocks when every connection is in use, so
+    # timing it gives the time requests spend queueing for a connection
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out)
+
+
+def engine_options(uri: str) -> dict:
+    backend = make_url(uri).get_backend_name()
+    options = {'echo': DB_ECHO}
+
+    # aiosqlite connections are not pooled, the pool settings only apply to
+    # the networked backends
+    if backend == 'sqlite':
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+    if backend == 'postgresql' and DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {
+            'server_settings': {'statement_timeout': str(DB_STATEMENT_TIMEOUT)}
+        }
+
+    return options
+
+
+engine = create_async_engine(
+    async_database_uri(SQLALCHEMY_DATABASE_URI),
+    **engine_options(SQLALCHEMY_DATABASE_URI)
+)
+
+if engine.dialect.name == 'sqlite':
+    # SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to
+    @event.listens_for(engine.sync_engine, 'connect')
+    def enable_foreign_keys(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=True)
-SessionLocal = sessionmaker(engine, autoflush=False, autocommit=False)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# zero when the replica has replayed everything it received, otherwise the
+# age of the last transaction it replayed
+REPLICA_LAG = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class Replica:
+    def __init__(self, uri: str):
+        self.name = make_url(uri).render_as_string(hide_password=True)
+        self.engine = create_async_engine(async_database_uri(uri), **engine_options(uri))
+        # unused until the first health check passes
+        self.healthy = False
+        self.lag: float | None = None
+        event.listen(self.engine.sync_engine, 'handle_error', self.on_error)
+
+    def on_error(self, context) -> None:
+        # stop routing to a replica that dropped a connection straight away
+        # rather than at the next health check
+        if context.is_disconnect:
+            self.healthy = False
+
+
+class ReplicaRouter:
+    # Picks the engine for read-only sessions: replicas in turn while they
+    # are healthy and within DB_REPLICA_MAX_LAG, the primary otherwise.
+    # Reads that must see a recent write, the writer's own requests and
+    # rebuilds of the cache entries a write changed, run under on_primary() or
+    # after use_primary(), which only affect the current task and the tasks
+    # it starts, see app.utils.cache.written_recently().
+
+    def __init__(self, primary: AsyncEngine, uris: list[str]):
+        self.primary = primary
+        self.replicas = [Replica(uri) for uri in uris]
+        self.turn = itertools.count()
+        self.pinned: ContextVar[bool] = ContextVar('primary_reads', default=False)
+
+    def use_primary(self) -> None:
+        self.pinned.set(True)
+
+    @contextmanager
+    def on_primary(self):
+        token = self.pinned.set(True)
+        try:
+            yield
+        finally:
+            self.pinned.reset(token)
+
+    def pick(self) -> AsyncEngine:
+        if self.pinned.get():
+            return self.primary
+
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return self.primary
+
+        return healthy[next(self.turn) % len(healthy)].engine
+
+    async def check(self, replica: Replica) -> None:
+        try:
+            async with replica.engine.connect() as conn:
+                if replica.engine.dialect.name == 'postgresql':
+                    replica.lag = float(await conn.scalar(REPLICA_LAG) or 0)
+                else:
+                    await conn.execute(text('SELECT 1'))
+                    replica.lag = 0.0
+        except (exc.DBAPIError, OSError, asyncio.TimeoutError) as e:
+            if replica.healthy:
+                logger.warning('Replica %s unavailable, reading from the primary: %r', replica.name, e)
+            replica.healthy = False
+            return
+
+        healthy = replica.lag <= DB_REPLICA_MAX_LAG
+        if replica.healthy and not healthy:
+            logger.warning('Replica %s is %.1fs behind, reading from the primary', replica.name, replica.lag)
+        replica.healthy = healthy
+
+    async def monitor(self) -> None:
+        # runs for the lifetime of the app
+        while True:
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+    def status(self) -> list[dict]:
+        return [
+            {'replica': replica.name, 'healthy': replica.healthy, 'lag_seconds': replica.lag}
+            for replica in self.replicas
+        ]
+
+
+replicas = ReplicaRouter(engine, DB_REPLICA_URIS)
+
+def read_session() -> AsyncSession:
+    return SessionLocal(bind=replicas.pick())
+
+def pool_metrics() -> dict:
+    pool = engine.pool
+    metrics = {
+        'pool_class': type(pool).__name__,
+        'wait_count': pool_stats.checkouts,
+        'wait_timeouts': pool_stats.timeouts,
+        'wait_time_total_seconds': round(pool_stats.wait_time_total, 6),
+        'wait_time_max_seconds': round(pool_stats.wait_time_max, 6),
+    }
+
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        metrics.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=DB_MAX_OVERFLOW,
+        )
+
+    return metrics
+
 async def get_db():
-    db = SessionLocal()
+    async with SessionLocal() as db:
+        yield db
 
-    try:
+async def get_read_db():
+    # for handlers that only read
+    async with read_session() as db:
         yield db
-    finally:
-        db.close()
 
-def init_db():
-    Base.metadata.create_all(engine)
\ No newline at end of file
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
@@ -4,4 +4,12 @@ class MealType(str, Enum):
     breakfast = "breakfast"
     lunch = "lunch"
     dinner = "dinner"
-    dessert = "dessert"
\ No newline at end of file
+    dessert = "dessert"
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class IngredientMatch(str, Enum):
+    all = "all"
+    any = "any"
\ No newline at end of file
@@ -0,0 +1,59 @@
+import base64
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import Select, tuple_
+
+from app.models.recipe import Recipe
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Listings are ordered newest first on (created_at, id). The cursor is the
+# sort key of the last row of a page, so the next page is an index range scan
+# starting right after it rather than an OFFSET that rescans earlier pages.
+
+def _encode(*parts) -> str:
+    raw = '|'.join(map(str, parts)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode(cursor: str, *types) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        parts = raw.split('|')
+        if len(parts) != len(types):
+            raise ValueError
+        return tuple(cast(part) for cast, part in zip(types, parts))
+    except ValueError as e:
+        raise ValueError(f'Invalid cursor, {cursor}') from e
+
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    return _encode(created_at.isoformat(), id)
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    return _decode(cursor, datetime.fromisoformat, UUID)
+
+# ranked listings (search) page on (rank, id) instead
+
+def encode_rank_cursor(rank: float, id: UUID) -> str:
+    return _encode(repr(rank), id)
+
+def decode_rank_cursor(cursor: str) -> tuple[float, UUID]:
+    return _decode(cursor, float, UUID)
+
+def paginate(query: Select, cursor: str | None, limit: int) -> Select:
+    query = query.order_by(Recipe.created_at.desc(), Recipe.id.desc())
+
+    if cursor:
+        query = query.where(tuple_(Recipe.created_at, Recipe.id) < decode_cursor(cursor))
+
+    # one extra row tells us whether there is a next page
+    return query.limit(limit + 1)
+
+def split_page(rows: list, limit: int) -> tuple[list, str | None]:
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
@@ -1,9 +1,48 @@
-from app.config.database import init_db
-from app.routers import recipe, user
+import asyncio
+from contextlib import asynccontextmanager
+
+from app.config.database import SessionLocal, engine, init_db, replicas
+from app.routers import health, metrics, recipe, user
+from app.utils import popularity
+from app.utils.cache import close_redis, connect_redis, listen
+from app.utils.metrics import MetricsMiddleware, instrument_engine
+from app.utils.rate_limit import rate_limited_http_exception
+from app.utils.search import search_backend
+from app.workers.warmup import warm_on_startup
 
 from fastapi import FastAPI
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with SessionLocal() as session:
+        await search_backend.load(session)
+
+    await connect_redis()
+    invalidation_listener = asyncio.create_task(listen())
+    replica_monitor = asyncio.create_task(replicas.monitor())
+    popularity_tracker = asyncio.create_task(popularity.run())
+    await warm_on_startup()
+
+    yield
+
+    invalidation_listener.cancel()
+    replica_monitor.cancel()
+    popularity_tracker.cancel()
+    await popularity.flush()
+    for replica in replicas.replicas:
+        await replica.engine.dispose()
+    await close_redis()
+
+instrument_engine(engine)
+for replica in replicas.replicas:
+    instrument_engine(replica.engine)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_exception_handler(StarletteHTTPException, rate_limited_http_exception)
 
 app.include_router(recipe.router)
-app.include_router(user.router)
\ No newline at end of file
+app.include_router(user.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
\ No newline at end of file
@@ -1,18 +1,32 @@
-import uuid
+import os, time, uuid
+from datetime import datetime, timezone
 from app.config.database import Base
 from sqlalchemy import Column, UUID, DateTime
-from sqlalchemy.sql import func
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def uuid7() -> uuid.UUID:
+    # RFC 9562 version 7, the unix time in milliseconds followed by random
+    # bits. New ids sort after older ones, so inserts append to the right
+    # edge of the primary key index instead of splitting pages all over it.
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return uuid.UUID(int=value)
 
 class BaseModel(Base):
     __abstract__ = True
 
+    # the primary key is already unique and indexed, don't add a second index
     id = Column(
         UUID(as_uuid=True), 
-        unique=True, 
         primary_key=True,
-        default=uuid.uuid4,
-        nullable=False,
-        index=True
+        default=uuid7,
+        nullable=False
     )
-    created_at = Column(DateTime(timezone=True), default=func.now())
-    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
\ No newline at end of file
+    # stamped in Python rather than with now() so rows keep microsecond
+    # precision and the same timezone on every backend and every write path,
+    # which keyset pagination relies on
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
\ No newline at end of file
@@ -0,0 +1,18 @@
+from app.config.database import Base
+from app.models.base import BaseModel
+from sqlalchemy import Column, ForeignKey, Index, String, Table, UUID
+
+class Ingredient(BaseModel):
+    __tablename__ = 'ingredient'
+
+    name = Column(String, unique=True, nullable=False)
+
+# keyed ingredient first so every recipe containing an ingredient is a single
+# index range, the recipe_id index serves rewriting one recipe's ingredients
+recipe_ingredient = Table(
+    'recipe_ingredient',
+    Base.metadata,
+    Column('ingredient_id', UUID(as_uuid=True), ForeignKey('ingredient.id', ondelete='CASCADE'), primary_key=True),
+    Column('recipe_id', UUID(as_uuid=True), ForeignKey('recipe.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_recipe_ingredient_recipe_id', 'recipe_id'),
+)
@@ -1,9 +1,14 @@
 from app.models.base import BaseModel
 from app.helpers.enums import MealType
-from sqlalchemy import Column, String, Enum
+from sqlalchemy import Column, String, Enum, Index
 
 class Recipe(BaseModel):
     __tablename__ = 'recipe'
+    __table_args__ = (
+        Index('ix_recipe_created_at_id', 'created_at', 'id'),
+        Index('ix_recipe_updated_at_id', 'updated_at', 'id'),
+        Index('ix_recipe_meal_type_created_at_id', 'meal_type', 'created_at', 'id'),
+    )
 
     name = Column(String, nullable=False)
     description = Column(String, nullable=False)
@@ -0,0 +1,16 @@
+from app.config.database import pool_metrics, replicas
+
+from fastapi import APIRouter, status
+
+router = APIRouter(
+    prefix="/health",
+    tags=["health"]
+)
+
+@router.get("/db", status_code=status.HTTP_200_OK)
+async def database_pool():
+    return pool_metrics()
+
+@router.get("/replicas", status_code=status.HTTP_200_OK)
+async def database_replicas():
+    return replicas.status()
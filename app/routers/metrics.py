@@ -0,0 +1,10 @@
+from app.utils.metrics import latest_metrics
+
+from fastapi import APIRouter, Response, status
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", status_code=status.HTTP_200_OK, include_in_schema=False)
+async def metrics() -> Response:
+    payload, media_type = latest_metrics()
+    return Response(content=payload, media_type=media_type)
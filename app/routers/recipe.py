@@ -1,12 +1,27 @@
-import redis, json
-from app.config.database import get_db
-from app.helpers.enums import MealType
+from app.config.database import get_db, read_session
+from app.helpers.enums import ExportFormat, IngredientMatch, MealType
 from app.models.recipe import Recipe
-from app.schemas.recipe import RecipeCreate, RecipeResponse, RecipeUpdate
+from app.helpers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate, split_page
+from app.schemas.recipe import (
+    RecipeBatchResponse, RecipeBulkDeleteResponse, RecipeBulkResponse, RecipeBulkUpdate,
+    RecipeCreate, RecipePage, RecipeResponse, RecipeUpdate
+)
 from app.utils.auth import get_current_user
-from app.models.user import User
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from app.utils import popularity
+from app.utils.cache import CACHE_PAGE_TTL, CacheEntry, cached, cached_many, invalidate, versioned_key
+from app.utils.ingredients import containing, ingredient_names, sync_ingredients
+from app.utils.search import search_backend
+from app.utils.serializers import (
+    RECIPE_FIELDS, SUMMARY_FIELDS, cached_response, encode_batch, encode_bulk, encode_csv, encode_ndjson,
+    encode_page, encode_recipe, json_response
+)
+from app.schemas.user import UserPrincipal
+from datetime import datetime
+from decouple import config as env
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from uuid import UUID
 
@@ -15,14 +30,110 @@ router = APIRouter(
     tags=["recipes"]
 )
 
-rd = redis.Redis(host='localhost', port=6379, db=0)
+RECIPES = 'recipes'
+RECIPES_SEARCH = 'recipes:search'
+RECIPES_CONTAINING = 'recipes:containing'
+
+# rows fetched per round trip from the server side cursor, and so the most
+# recipes an export holds in memory at once
+EXPORT_BATCH_SIZE = env('EXPORT_BATCH_SIZE', default=1000, cast=int)
+BULK_MAX_ITEMS = env('BULK_MAX_ITEMS', default=1000, cast=int)
+BATCH_MAX_IDS = env('BATCH_MAX_IDS', default=100, cast=int)
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.ndjson: 'application/x-ndjson',
+    ExportFormat.csv: 'text/csv',
+}
+
+def meal_type_namespace(meal_type: MealType) -> str:
+    return f'recipes:meal_type:{meal_type.value}'
+
+def recipe_key(id) -> str:
+    return f'recipe:{id}'
+
+def affected_namespaces(*meal_types: MealType) -> set[str]:
+    # any write can change the full listing and any search result, but only
+    # the filters for the meal types the recipe had before and after
+    return {RECIPES, RECIPES_SEARCH, RECIPES_CONTAINING, *map(meal_type_namespace, meal_types)}
+
+def projection(
+    fields: str | None = Query(
+        None, description='Comma separated fields to return, or summary for id, name, description and meal_type'
+    )
+) -> tuple[str, ...]:
+    if fields is None:
+        return RECIPE_FIELDS
+    if fields == 'summary':
+        return SUMMARY_FIELDS
+
+    requested = {field.strip() for field in fields.split(',')} - {''}
+    unknown = requested - set(RECIPE_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Unknown fields, {", ".join(sorted(unknown))}'
+        )
+
+    # in a fixed order so every spelling of a projection shares its cache entries
+    return tuple(field for field in RECIPE_FIELDS if field in requested | {'id'})
+
+def projection_key(fields: tuple[str, ...]) -> str:
+    if fields == RECIPE_FIELDS:
+        return 'all'
+    if fields == SUMMARY_FIELDS:
+        return 'summary'
+    return ','.join(fields)
+
+def projected_columns(fields: tuple[str, ...]) -> list:
+    # only the requested columns, plus the sort key the next cursor is built from
+    return [column for column in Recipe.__table__.columns if column.name in {*fields, 'created_at', 'id'}]
+
+async def fetch_page(session: AsyncSession, query, cursor: str | None, limit: int):
+    try:
+        query = paginate(query, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return split_page((await session.execute(query)).all(), limit)
+
+# the page queries before pagination, shared with benchmarks.query_plans so
+# it explains what the routes run
+def recipes_query(fields: tuple[str, ...]):
+    return select(*projected_columns(fields))
+
+def meal_type_query(type: MealType, fields: tuple[str, ...]):
+    return recipes_query(fields).where(Recipe.meal_type == type)
+
+def containing_query(names: list[str], match: IngredientMatch, fields: tuple[str, ...]):
+    return recipes_query(fields).where(Recipe.id.in_(containing(names, match)))
+
+def export_query(updated_since: datetime | None = None):
+    query = (
+        select(*Recipe.__table__.columns)
+        .order_by(Recipe.updated_at, Recipe.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    if updated_since:
+        query = query.where(Recipe.updated_at > updated_since)
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
+    return query
+
+def check_batch(items: list) -> None:
+    if not 0 < len(items) <= BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'A batch must hold between 1 and {BULK_MAX_ITEMS} recipes'
+        )
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=RecipeResponse)
 async def create_recipe(
-    body: RecipeCreate, 
-    session: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
-) -> RecipeResponse:
+    body: RecipeCreate,
+    session: AsyncSession = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
     recipe = Recipe(
         name=body.name,
         description=body.description,
@@ -33,172 +144,359 @@ async def create_recipe(
     )
 
     session.add(recipe)
-    session.commit()
-    session.refresh(recipe)
+    await session.flush()
+    await sync_ingredients(session, [recipe])
+    await session.commit()
+    await session.refresh(recipe)
 
-    return recipe
+    payload = encode_recipe(recipe)
 
-@router.get("/", status_code=status.HTTP_200_OK)
-async def get_recipes(
-        session: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
-) -> List[RecipeResponse]:
-
-    cached = rd.get('recipes')
-
-    if cached:
-        print('cache hit!')
-        return json.loads(cached)
-    
-    recipes = session.query(Recipe).all()
-
-    recipes_response = [
-        {
-            "id": str(recipe.id), 
-            "name": recipe.name,
-            "description": recipe.description,
-            "ingredients": recipe.ingredients,
-            "instructions": recipe.instructions,
-            "servings": recipe.servings,
-            "meal_type": recipe.meal_type,
-            "created_at": recipe.created_at.isoformat(),
-            "updated_at": recipe.updated_at.isoformat(),  
-        }
-        for recipe in recipes
-    ]
+    search_backend.index(recipe)
+    await invalidate(
+        affected_namespaces(recipe.meal_type),
+        put={recipe_key(recipe.id): payload}
+    )
 
+    return json_response(payload, status.HTTP_201_CREATED)
 
-    print('cache miss!')
-    rd.setex('recipes', 1800, json.dumps(recipes_response))
+async def recipes_page(cursor: str | None, limit: int, fields: tuple[str, ...]) -> CacheEntry:
 
-    return recipes_response
+    async def build():
+        async with read_session() as session:
+            recipes, next_cursor = await fetch_page(session, recipes_query(fields), cursor, limit)
 
-@router.get("/filter", status_code=status.HTTP_200_OK)
-async def filter_recipe_by_meal_type(
-    type: MealType, 
-    session: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-) -> List[RecipeResponse]:
-    cache_key = f'recipes:meal_type:{type.value}'
+        return encode_page(recipes, next_cursor, fields)
+
+    cache_key = await versioned_key(RECIPES, limit, cursor or 'first', projection_key(fields))
 
-    cached = rd.get(cache_key)
-    if cached:
-        print('cache hit!')
-        return json.loads(cached)
+    return await cached(cache_key, build, CACHE_PAGE_TTL)
 
-    recipes = session.query(Recipe).filter_by(meal_type=type).all()
+async def meal_type_page(type: MealType, cursor: str | None, limit: int, fields: tuple[str, ...]) -> CacheEntry:
 
-    if not recipes:
+    async def build():
+        async with read_session() as session:
+            recipes, next_cursor = await fetch_page(session, meal_type_query(type, fields), cursor, limit)
+
+        if not recipes and not cursor:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'No recipes found with meal type {type.value}'
+            )
+
+        return encode_page(recipes, next_cursor, fields)
+
+    cache_key = await versioned_key(
+        meal_type_namespace(type), limit, cursor or 'first', projection_key(fields)
+    )
+
+    return await cached(cache_key, build, CACHE_PAGE_TTL)
+
+async def load_recipes(ids: list[UUID]) -> dict[UUID, bytes]:
+    async with read_session() as session:
+        recipes = await session.scalars(select(Recipe).where(Recipe.id.in_(ids)))
+        return {recipe.id: encode_recipe(recipe) for recipe in recipes}
+
+@router.get("/", status_code=status.HTTP_200_OK, response_model=RecipePage)
+async def get_recipes(
+        request: Request,
+        cursor: str | None = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        fields: tuple[str, ...] = Depends(projection),
+        current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    return cached_response(request, await recipes_page(cursor, limit, fields))
+
+@router.get("/filter", status_code=status.HTTP_200_OK, response_model=RecipePage)
+async def filter_recipe_by_meal_type(
+    request: Request,
+    type: MealType,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: tuple[str, ...] = Depends(projection),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    return cached_response(request, await meal_type_page(type, cursor, limit, fields))
+
+@router.get("/search", status_code=status.HTTP_200_OK, response_model=RecipePage)
+async def search_recipe(
+    request: Request,
+    name:str,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: tuple[str, ...] = Depends(projection),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+
+    async def build():
+        try:
+            async with read_session() as session:
+                recipes, next_cursor = await search_backend.search(
+                    session, name, cursor, limit, projected_columns(fields)
+                )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+
+        if not recipes and not cursor:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'No recipes found matching, {name}'
+            )
+
+        return encode_page(recipes, next_cursor, fields)
+
+    cache_key = await versioned_key(
+        RECIPES_SEARCH, limit, cursor or 'first', projection_key(fields), name.lower()
+    )
+
+    return cached_response(request, await cached(cache_key, build, CACHE_PAGE_TTL))
+
+@router.get("/containing", status_code=status.HTTP_200_OK, response_model=RecipePage)
+async def filter_recipes_by_ingredients(
+    request: Request,
+    ingredients: str,
+    match: IngredientMatch = IngredientMatch.all,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: tuple[str, ...] = Depends(projection),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    names = ingredient_names(ingredients)
+
+    if not names:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'No recipes found with meal type {type.value}'
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Provide at least one ingredient, separated by commas'
         )
 
-    recipes_response = [
-        {
-            "id": str(recipe.id),
-            "name": recipe.name,
-            "description": recipe.description,
-            "ingredients": recipe.ingredients,
-            "instructions": recipe.instructions,
-            "servings": recipe.servings,
-            "meal_type": recipe.meal_type,
-            "created_at": recipe.created_at.isoformat(),
-            "updated_at": recipe.updated_at.isoformat()
-        } for recipe in recipes
-    ]
+    async def build():
+        async with read_session() as session:
+            recipes, next_cursor = await fetch_page(
+                session, containing_query(names, match, fields), cursor, limit
+            )
 
-    print('cache miss!')
-    rd.setex(cache_key, 3600, json.dumps(recipes_response))
+        if not recipes and not cursor:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'No recipes found containing {match.value} of, {", ".join(names)}'
+            )
 
-    return recipes_response
+        return encode_page(recipes, next_cursor, fields)
 
-@router.get("/search", status_code=status.HTTP_200_OK)
-async def search_recipe(
-    name:str, 
-    session: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-) -> List[RecipeResponse]:
-    cache_key = f"recipes:search:{name.lower()}"
-    cached = rd.get(cache_key)
+    cache_key = await versioned_key(
+        RECIPES_CONTAINING, match.value, limit, cursor or 'first', projection_key(fields), ','.join(sorted(names))
+    )
 
-    if cached:
-        print("cache hit!")
-        return json.loads(cached)
+    return cached_response(request, await cached(cache_key, build, CACHE_PAGE_TTL))
+
+async def stream_export(query, format: ExportFormat):
+    # the session is opened here rather than injected, a dependency's session
+    # would be closed before the body has finished streaming
+    async with read_session() as session:
+        result = await session.stream(query)
+
+        if format == ExportFormat.csv:
+            yield encode_csv([], header=True)
+
+        # each partition is one batch off the cursor; the next one is only
+        # fetched once the client has taken this one
+        async for rows in result.partitions():
+            yield encode_ndjson(rows) if format == ExportFormat.ndjson else encode_csv(rows)
+
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_recipes(
+    format: ExportFormat = ExportFormat.ndjson,
+    updated_since: datetime | None = None,
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> StreamingResponse:
+    return StreamingResponse(
+        stream_export(export_query(updated_since), format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="recipes.{format.value}"'}
+    )
 
-    recipes = session.query(Recipe).filter(Recipe.name.ilike(f'%{name}%')).all()
+@router.get("/batch", status_code=status.HTTP_200_OK, response_model=RecipeBatchResponse)
+async def get_recipes_by_ids(
+    ids: str = Query(description='Comma separated recipe IDs'),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    try:
+        # repeated ids are returned once, at their first position
+        ids = list(dict.fromkeys(UUID(id.strip()) for id in ids.split(',') if id.strip()))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='ids must be comma separated recipe IDs'
+        )
 
-    if not recipes:
+    if not ids or len(ids) > BATCH_MAX_IDS:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'No recipes found with name containing, {name}'
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Provide between 1 and {BATCH_MAX_IDS} recipe IDs'
         )
 
-    recipes_response = [
-        {
-            "id": str(recipe.id),
-            "name": recipe.name,
-            "description": recipe.description,
-            "ingredients": recipe.ingredients,
-            "instructions": recipe.instructions,
-            "servings": recipe.servings,
-            "meal_type": recipe.meal_type,
-            "created_at": recipe.created_at.isoformat(),
-            "updated_at": recipe.updated_at.isoformat()
-        } for recipe in recipes
+    entries = await cached_many({id: recipe_key(id) for id in ids}, load_recipes)
+    popularity.record(entries)
+
+    return json_response(encode_batch(
+        [entries[id].payload for id in ids if id in entries],
+        [id for id in ids if id not in entries]
+    ))
+
+# Batches are written in a single transaction and invalidate the cache once,
+# however many recipes they touch. Items that can't be applied are reported
+# in errors by their position in the request and don't fail the batch.
+
+@router.post("/bulk", status_code=status.HTTP_201_CREATED, response_model=RecipeBulkResponse)
+async def bulk_create_recipes(
+    body: List[RecipeCreate],
+    session: AsyncSession = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    check_batch(body)
+
+    # one multi-row INSERT ... RETURNING instead of a round trip per recipe
+    recipes = (await session.scalars(
+        insert(Recipe).returning(Recipe, sort_by_parameter_order=True),
+        [item.dict() for item in body]
+    )).all()
+    await sync_ingredients(session, recipes)
+    await session.commit()
+
+    for recipe in recipes:
+        search_backend.index(recipe)
+    await invalidate(
+        affected_namespaces(*{recipe.meal_type for recipe in recipes}),
+        put={recipe_key(recipe.id): encode_recipe(recipe) for recipe in recipes}
+    )
+
+    return json_response(encode_bulk(recipes, []), status.HTTP_201_CREATED)
+
+@router.put("/bulk", status_code=status.HTTP_200_OK, response_model=RecipeBulkResponse)
+async def bulk_update_recipes(
+    body: List[RecipeBulkUpdate],
+    session: AsyncSession = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    check_batch(body)
+
+    found = await session.scalars(select(Recipe).where(Recipe.id.in_({item.id for item in body})))
+    recipes = {recipe.id: recipe for recipe in found.all()}
+
+    updated, relinked, meal_types, errors = {}, [], set(), []
+    for index, item in enumerate(body):
+        recipe = recipes.get(item.id)
+
+        if recipe is None:
+            errors.append({'index': index, 'id': item.id, 'detail': f'Recipe with ID, {item.id} not found'})
+            continue
+        if item.id in updated:
+            errors.append({'index': index, 'id': item.id, 'detail': f'Recipe with ID, {item.id} is already in this batch'})
+            continue
+
+        changes = item.dict(exclude_unset=True, exclude={'id'})
+        # every recipe column is required, a null would fail the whole flush
+        nulls = [key for key, value in changes.items() if value is None]
+        if nulls:
+            errors.append({'index': index, 'id': item.id, 'detail': f'{", ".join(nulls)} cannot be null'})
+            continue
+
+        meal_types.add(recipe.meal_type)
+        for key, value in changes.items():
+            setattr(recipe, key, value)
+        if 'ingredients' in changes:
+            relinked.append(recipe)
+        updated[recipe.id] = recipe
+
+    # the flush groups the rows by the columns they change and sends each
+    # group as a single executemany
+    await session.flush()
+    await sync_ingredients(session, relinked)
+    await session.commit()
+
+    if updated:
+        # encode the stored rows rather than the values the flush sent, the
+        # database may hand timestamps back differently, e.g. SQLite drops
+        # the timezone, and every path must produce the same payload
+        stored = await session.scalars(
+            select(Recipe).where(Recipe.id.in_(updated)).execution_options(populate_existing=True)
+        )
+        stored = {recipe.id: recipe for recipe in stored}
+        updated = {id: stored[id] for id in updated}
+
+        for recipe in updated.values():
+            search_backend.index(recipe)
+            meal_types.add(recipe.meal_type)
+        await invalidate(
+            affected_namespaces(*meal_types),
+            put={recipe_key(id): encode_recipe(recipe) for id, recipe in updated.items()}
+        )
+
+    return json_response(encode_bulk(updated.values(), errors))
+
+@router.delete("/bulk", status_code=status.HTTP_200_OK, response_model=RecipeBulkDeleteResponse)
+async def bulk_delete_recipes(
+    body: List[UUID],
+    session: AsyncSession = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> dict:
+    check_batch(body)
+
+    result = await session.execute(
+        delete(Recipe).where(Recipe.id.in_(set(body))).returning(Recipe.id, Recipe.meal_type)
+    )
+    deleted = dict(result.all())
+    await session.commit()
+
+    errors = [
+        {'index': index, 'id': id, 'detail': f'Recipe with ID, {id} not found.'}
+        for index, id in enumerate(body) if id not in deleted
     ]
 
-    print("cache miss!")
-    rd.setex(cache_key, 1800, json.dumps(recipes_response))
+    if deleted:
+        for id in deleted:
+            search_backend.remove(id)
+        await invalidate(
+            affected_namespaces(*set(deleted.values())),
+            drop=[recipe_key(id) for id in deleted]
+        )
 
-    return recipes_response
+    return {'deleted': list(deleted), 'errors': errors}
 
-@router.get("/{id}", status_code=status.HTTP_200_OK)
+@router.get("/{id}", status_code=status.HTTP_200_OK, response_model=RecipeResponse)
 async def get_recipe_with_id(
-    id: UUID, 
-    session: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-) -> RecipeResponse:
-    cache_key = f"recipe:{id}"
-    cached = rd.get(cache_key)
+    request: Request,
+    id: UUID,
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
 
-    if cached:
-        print("cache hit!")
-        return json.loads(cached)
+    async def build():
+        async with read_session() as session:
+            recipe = await session.get(Recipe, id)
 
-    recipe = session.query(Recipe).get(id)
+        if not recipe:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'Recipe with ID, {id} does not exist'
+            )
 
-    if not recipe:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'Recipe with ID, {id} does not exist'
-        )
+        return encode_recipe(recipe)
+
+    entry = await cached(recipe_key(id), build)
+    popularity.record([id])
+
+    return cached_response(request, entry)
 
-    recipe_response = {
-        "id": str(recipe.id),
-        "name": recipe.name,
-        "description": recipe.description,
-        "ingredients": recipe.ingredients,
-        "instructions": recipe.instructions,
-        "servings": recipe.servings,
-        "meal_type": recipe.meal_type,
-        "created_at": recipe.created_at.isoformat(),
-        "updated_at": recipe.updated_at.isoformat(),
-    }
-        
-    print("cache miss!")
-    rd.setex(cache_key, 1800, json.dumps(recipe_response))
-
-    return recipe_response
-
-@router.put("/{id}", status_code=status.HTTP_200_OK)
+@router.put("/{id}", status_code=status.HTTP_200_OK, response_model=RecipeResponse)
 async def update_recipe(
-    id: UUID, 
-    body: RecipeUpdate, 
-    session: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-) -> RecipeResponse:
-    recipe = session.query(Recipe).get(id)
+    id: UUID,
+    body: RecipeUpdate,
+    session: AsyncSession = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> Response:
+    recipe = await session.get(Recipe, id)
 
     if not recipe:
         raise HTTPException(
@@ -206,23 +504,35 @@ async def update_recipe(
             detail=f'Recipe with ID, {id} not found'
         )
 
-    for key, value in body.dict(exclude_unset=True).items():
+    previous_meal_type = recipe.meal_type
+    changes = body.dict(exclude_unset=True)
+
+    for key, value in changes.items():
         setattr(recipe, key, value)
 
-    session.commit()
-    session.refresh(recipe)
-    
-    return recipe
+    if 'ingredients' in changes:
+        await sync_ingredients(session, [recipe])
+
+    await session.commit()
+    await session.refresh(recipe)
+
+    payload = encode_recipe(recipe)
+
+    search_backend.index(recipe)
+    await invalidate(
+        affected_namespaces(previous_meal_type, recipe.meal_type),
+        put={recipe_key(recipe.id): payload}
+    )
+
+    return json_response(payload)
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_recipe(
-    id: UUID, 
-    session: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    id: UUID,
+    session: AsyncSession = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user)
 ) -> None:
-    cache_key = f"recipe:{id}"
-
-    recipe = session.query(Recipe).get(id)
+    recipe = await session.get(Recipe, id)
 
     if not recipe:
         raise HTTPException(
@@ -230,11 +540,10 @@ async def delete_recipe(
             detail=f'Recipe with ID, {id} not found.'
         )
 
-    session.delete(recipe)
-    session.commit()
-
-    rd.delete(cache_key)
+    await session.delete(recipe)
+    await session.commit()
 
-    print(f"Cache for recipe {id} has been invalidated.")
+    search_backend.remove(id)
+    await invalidate(affected_namespaces(recipe.meal_type), drop=[recipe_key(id)])
 
     return None
@@ -2,18 +2,22 @@ from uuid import UUID
 from datetime import timedelta
 from decouple import config as env
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, status, BackgroundTasks
 from itsdangerous import URLSafeTimedSerializer
 from pydantic import EmailStr
 
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.config.database import get_db
+from app.config.database import get_db, read_session, replicas
 from app.models.user import User
 from app.schemas.user import UserCreate, UserResponse, UserLogin, Token, PasswordReset
 from app.utils.mail import send_verification_email, send_password_reset_email
-from app.utils.auth import hash_password, verify_password, create_access_token
+from app.utils.auth import (
+    hash_password, verify_and_update_password, create_access_token, invalidate_principal, mark_user_written
+)
+from app.utils.cache import written_recently
+from app.utils.rate_limit import SLIDING_WINDOW, RateLimit, by_account, rate_limit, refund_limit
 
 router = APIRouter(
     prefix="/users",
@@ -21,12 +25,31 @@ router = APIRouter(
 )
 
 serializer = URLSafeTimedSerializer(env('SECRET_KEY'))
+ACCESS_TOKEN_EXPIRE_MINUTES = int(env('ACCESS_TOKEN_EXPIRE_MINUTES'))
+
+# requests/seconds. Per client IP, plus per account for the routes that mail
+# or check a password, so one account can't be hammered from many addresses.
+# Only failed logins count against the per account limit, otherwise the
+# user's own logins would use it up. Every attempt takes from it before the
+# password is checked, so concurrent guesses can't all get through, and a
+# successful one gives it back
+SIGNUP_LIMIT = RateLimit.parse(env('RATE_LIMIT_SIGNUP', default='5/3600'))
+LOGIN_LIMIT = RateLimit.parse(env('RATE_LIMIT_LOGIN', default='20/60'))
+LOGIN_ACCOUNT_LIMIT = RateLimit.parse(env('RATE_LIMIT_LOGIN_ACCOUNT', default='5/300'), SLIDING_WINDOW)
+PASSWORD_RESET_LIMIT = RateLimit.parse(env('RATE_LIMIT_PASSWORD_RESET', default='5/3600'))
+PASSWORD_RESET_ACCOUNT_LIMIT = RateLimit.parse(
+    env('RATE_LIMIT_PASSWORD_RESET_ACCOUNT', default='3/3600'), SLIDING_WINDOW
+)
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_user(body: UserCreate, background_tasks: BackgroundTasks, session: Session = Depends(get_db)) -> UserResponse:
-    existing_user = session.query(User).filter(
+@router.post(
+    "/",
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(rate_limit('signup', SIGNUP_LIMIT))]
+)
+async def create_user(body: UserCreate, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_db)) -> UserResponse:
+    existing_user = await session.scalar(select(User).where(
         or_(User.email == body.email, User.username == body.username)
-    ).first()
+    ))
 
     if existing_user:
         raise HTTPException(
@@ -34,7 +57,7 @@ async def create_user(body: UserCreate, background_tasks: BackgroundTasks, sessi
             detail='User with this username or email already exists'
         )
 
-    hashed_pwd = hash_password(body.password)
+    hashed_pwd = await hash_password(body.password)
 
     new_user = User(
         name=body.name,
@@ -44,22 +67,23 @@ async def create_user(body: UserCreate, background_tasks: BackgroundTasks, sessi
     )
 
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await session.commit()
+    await session.refresh(new_user)
+    await mark_user_written(new_user)
 
     token = serializer.dumps(new_user.email, salt='email-verification')
 
-    background_tasks.add_task(
-        send_verification_email,
+    await send_verification_email(
+        background_tasks,
         new_user.email,
         new_user.username,
         token
-    )    
+    )
 
     return new_user
 
 @router.get('/verify-email', status_code=status.HTTP_200_OK)
-async def verify_email(token:str, session: Session = Depends(get_db)):
+async def verify_email(token:str, session: AsyncSession = Depends(get_db)):
     try:
         # max_age = 3600 means the link is valid for an hour
         email = serializer.loads(token, salt='email-verification', max_age=3600)
@@ -69,7 +93,7 @@ async def verify_email(token:str, session: Session = Depends(get_db)):
             detail='Invalid or expired token'
         )
     
-    user = session.query(User).filter(User.email == email).first()
+    user = await session.scalar(select(User).where(User.email == email))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -77,13 +101,22 @@ async def verify_email(token:str, session: Session = Depends(get_db)):
         )
     
     user.is_verified = True
-    session.commit()
+    await session.commit()
+    await invalidate_principal(user.username)
+    await mark_user_written(user)
 
     return {'message':'Email verified successfully'}
 
-@router.post("/login", status_code=status.HTTP_200_OK)
-async def login(body: UserLogin, session: Session = Depends(get_db)):
-    user = session.query(User).filter(User.email == body.email).first()
+@router.post(
+    "/login",
+    status_code=status.HTTP_200_OK,
+    dependencies=[
+        Depends(rate_limit('login', LOGIN_LIMIT)),
+        Depends(rate_limit('login-account', LOGIN_ACCOUNT_LIMIT, key=by_account)),
+    ]
+)
+async def login(body: UserLogin, request: Request, session: AsyncSession = Depends(get_db)):
+    user = await session.scalar(select(User).where(User.email == body.email))
 
     if not user:
         raise HTTPException(
@@ -91,13 +124,22 @@ async def login(body: UserLogin, session: Session = Depends(get_db)):
             detail='Invalid credentials!'
         )
     
-    if not verify_password(body.password, user.password):
+    valid, new_hash = await verify_and_update_password(body.password, user.password)
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Invalid credentials'
         )
 
-    access_token_expires = timedelta(minutes=int(env('ACCESS_TOKEN_EXPIRE_MINUTES')))
+    await refund_limit(request, 'login-account')
+
+    if new_hash:
+        user.password = new_hash
+        await session.commit()
+        await mark_user_written(user)
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={'sub':user.username},
         expires_delta=access_token_expires
@@ -105,9 +147,16 @@ async def login(body: UserLogin, session: Session = Depends(get_db)):
 
     return Token(access_token=access_token, token_type='bearer')
 
-@router.post('/password-reset-request', status_code=status.HTTP_200_OK)
-async def password_reset_request(body: PasswordReset, background_tasks: BackgroundTasks, session: Session = Depends(get_db)):
-    user = session.query(User).filter(User.email == body.email).first()
+@router.post(
+    '/password-reset-request',
+    status_code=status.HTTP_200_OK,
+    dependencies=[
+        Depends(rate_limit('password-reset', PASSWORD_RESET_LIMIT)),
+        Depends(rate_limit('password-reset-account', PASSWORD_RESET_ACCOUNT_LIMIT, key=by_account)),
+    ]
+)
+async def password_reset_request(body: PasswordReset, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_db)):
+    user = await session.scalar(select(User).where(User.email == body.email))
 
     if not user:
         raise HTTPException(
@@ -117,17 +166,17 @@ async def password_reset_request(body: PasswordReset, background_tasks: Backgrou
 
     token = serializer.dumps(user.email, salt='password-reset')
 
-    background_tasks.add_task(
-        send_password_reset_email,
+    await send_password_reset_email(
+        background_tasks,
         user.email,
         user.username,
-        token      
+        token
     )
 
     return {'message': 'Password reset email sent successfully'}
 
 @router.put('/reset-password', status_code=status.HTTP_200_OK)
-async def reset_password(token: str, new_password:str, session: Session = Depends(get_db)):
+async def reset_password(token: str, new_password:str, session: AsyncSession = Depends(get_db)):
     try:
         email = serializer.loads(token, salt='password-reset', max_age=3600)
     except Exception:
@@ -136,22 +185,30 @@ async def reset_password(token: str, new_password:str, session: Session = Depend
             detail='Invalid or expired token'
         )
 
-    user = session.query(User).filter(User.email == email).first()
+    user = await session.scalar(select(User).where(User.email == email))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='User not found'
         )
 
-    hashed_password = hash_password(new_password)
+    hashed_password = await hash_password(new_password)
     user.password = hashed_password
-    session.commit()
+    await session.commit()
+    await invalidate_principal(user.username)
+    await mark_user_written(user)
 
     return {"message": "Password reset successfully."}
 
 @router.get("/{id}", status_code=status.HTTP_200_OK)
-async def get_user(id: UUID, session: Session = Depends(get_db)) -> UserResponse:
-    user = session.query(User).get(id)
+async def get_user(id: UUID) -> UserResponse:
+    # decided before the session is opened, a replica may not have a user
+    # created a moment ago
+    if await written_recently(f'user:{id}'):
+        replicas.use_primary()
+
+    async with read_session() as session:
+        user = await session.get(User, id)
 
     if not user:
         raise HTTPException(
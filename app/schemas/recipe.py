@@ -2,7 +2,7 @@ from app.helpers.enums import MealType
 from pydantic import BaseModel
 from uuid import UUID
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class RecipeBase(BaseModel):
     name : str
@@ -32,5 +32,26 @@ class RecipeResponse(RecipeBase):
     class Config:
         from_attributes = True
 
+class RecipePage(BaseModel):
+    items: List[RecipeResponse]
+    next_cursor: Optional[str] = None
 
+class RecipeBatchResponse(BaseModel):
+    items: List[RecipeResponse]
+    missing: List[UUID] = []
 
+class RecipeBulkUpdate(RecipeUpdate):
+    id: UUID
+
+class BulkItemError(BaseModel):
+    index: int
+    id: Optional[UUID] = None
+    detail: str
+
+class RecipeBulkResponse(BaseModel):
+    items: List[RecipeResponse]
+    errors: List[BulkItemError] = []
+
+class RecipeBulkDeleteResponse(BaseModel):
+    deleted: List[UUID]
+    errors: List[BulkItemError] = []
@@ -18,6 +18,16 @@ class UserResponse(UserBase):
     class Config:
         from_attributes = True
 
+class UserPrincipal(BaseModel):
+    id: UUID
+    name: str
+    email: EmailStr
+    username: str
+    is_verified: bool
+
+    class Config:
+        from_attributes = True
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
@@ -1,31 +1,80 @@
-import jwt
+import asyncio, jwt, time
 from jwt.exceptions import InvalidTokenError
 
 from datetime import timedelta, datetime, timezone
 from decouple import config as env
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated
 from passlib.context import CryptContext
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from app.config.database import get_db
+from app.config.database import read_session, replicas
 from app.models.user import User
-from app.schemas.user import TokenData
+from app.schemas.user import TokenData, UserPrincipal
+from app.utils.cache import LocalCache, cached, invalidate, mark_written, written_recently
+from app.utils.metrics import PASSWORD_HASH_SECONDS
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 
 
-pwd_content = CryptContext(schemes=['bcrypt'], deprecated='auto')
+JWT_SECRET = env('JWT_SECRET')
+JWT_ALGORITHM = env('JWT_ALGORITHM')
+
+BCRYPT_ROUNDS = env('BCRYPT_ROUNDS', default=12, cast=int)
+PASSWORD_HASH_WORKERS = env('PASSWORD_HASH_WORKERS', default=4, cast=int)
+
+# min/max pinned to the configured cost so verify_and_update flags hashes
+# made with any other cost and they get rehashed on the next login
+pwd_content = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto',
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def hash_password(password: str):
-    return pwd_content.hash(password)
+TOKEN_CACHE_SIZE = env('TOKEN_CACHE_SIZE', default=10000, cast=int)
+TOKEN_CACHE_TTL = env('TOKEN_CACHE_TTL', default=300, cast=float)
+# how long a user's principal is served from cache, writes that change it
+# invalidate it straight away
+PRINCIPAL_CACHE_TTL = env('PRINCIPAL_CACHE_TTL', default=300, cast=int)
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+decoded_tokens = LocalCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+# bcrypt releases the GIL while hashing, so a thread pool is enough to keep
+# it off the event loop; its size caps how many CPU cores hashing can take
+password_hasher = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+
+def timed(operation: str, fn, *args):
+    # runs on the hashing thread, so queueing for a thread isn't counted
+    with PASSWORD_HASH_SECONDS.labels(operation).time():
+        return fn(*args)
+
+async def hash_password(password: str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hasher, timed, 'hash', pwd_content.hash, password)
+
+
+async def verify_password(plain_pwd: str, hashed_pwd:str):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_hasher, timed, 'verify', pwd_content.verify, plain_pwd, hashed_pwd
+    )
 
 
-def verify_password(plain_pwd: str, hashed_pwd:str):
-    return pwd_content.verify(plain_pwd, hashed_pwd)
+async def verify_and_update_password(plain_pwd: str, hashed_pwd: str) -> tuple[bool, str | None]:
+    # returns a new hash alongside the result when the stored one was made
+    # with a different cost
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_hasher, timed, 'verify', pwd_content.verify_and_update, plain_pwd, hashed_pwd
+    )
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -37,11 +86,35 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
 
     to_encode.update({'exp':expire})
-    encoded_jwt = jwt.encode(to_encode, env('JWT_SECRET'), algorithm=env('JWT_ALGORITHM'))
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+def principal_key(username: str) -> str:
+    return f'principal:{username}'
+
+async def mark_user_written(user: User) -> None:
+    # for writes to a user made without their token, so their next requests,
+    # and GET /users/{id}, don't miss it on a lagging replica
+    await mark_written(user.username, f'user:{user.id}')
+
+async def invalidate_principal(username: str) -> None:
+    await invalidate([], drop=[principal_key(username)])
+
+def decode_token(token: str) -> dict:
+    # signature checks are cached per token, the expiry is still enforced on
+    # every call
+    payload = decoded_tokens.get(token)
+
+    if payload is None:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        decoded_tokens.set(token, payload)
+    elif payload.get('exp', 0) <= time.time():
+        raise InvalidTokenError('Signature has expired')
+
+    return payload
+
 # THE CODE BELOW VERIFIES THE JWT AND RETURNS THE USER
-def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: Session = Depends(get_db)):
+async def get_current_user(request: Request, token: Annotated[str, Depends(oauth2_scheme)]) -> UserPrincipal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
@@ -49,7 +122,7 @@ def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: Ses
     )
 
     try:
-        payload = jwt.decode(token, env('JWT_SECRET'), algorithms=[env('JWT_ALGORITHM')])
+        payload = decode_token(token)
 
         username: str = payload.get('sub')
         if username is None:
@@ -58,11 +131,22 @@ def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: Ses
     except InvalidTokenError:
         raise credentials_exception  
 
-    user = session.query(User).filter(User.username == username).first()
-
-    if user is None:
-        raise credentials_exception
-    return user
+    # a user who just wrote reads from the primary until the replicas have
+    # caught up, everyone else keeps reading from the replicas
+    if request.method not in SAFE_METHODS:
+        await mark_written(username)
+        replicas.use_primary()
+    elif await written_recently(username):
+        replicas.use_primary()
 
+    async def build():
+        async with read_session() as session:
+            user = await session.scalar(select(User).where(User.username == username))
 
+        if user is None:
+            raise credentials_exception
+        return UserPrincipal.model_validate(user).model_dump_json()
 
+    return UserPrincipal.model_validate_json(
+        (await cached(principal_key(username), build, PRINCIPAL_CACHE_TTL)).payload
+    )
@@ -0,0 +1,568 @@
+import asyncio, hashlib, json, logging, math, random, struct, time, uuid
+import redis.asyncio as redis
+from collections import OrderedDict
+from decouple import config as env
+from redis.exceptions import RedisError
+from typing import Awaitable, Callable, Iterable, NamedTuple
+
+from app.config.database import DB_READ_YOUR_WRITES_WINDOW, replicas
+from app.utils.metrics import (
+    CACHE_INVALIDATIONS, CACHE_REBUILD_SECONDS, CACHE_REQUESTS, REDIS_ERRORS_TOTAL, REDIS_SECONDS,
+    key_family
+)
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = env('REDIS_URL', default='redis://localhost:6379/0')
+REDIS_MAX_CONNECTIONS = env('REDIS_MAX_CONNECTIONS', default=50, cast=int)
+# seconds to wait for a free connection when the pool is exhausted
+REDIS_POOL_TIMEOUT = env('REDIS_POOL_TIMEOUT', default=0.1, cast=float)
+REDIS_SOCKET_TIMEOUT = env('REDIS_SOCKET_TIMEOUT', default=0.25, cast=float)
+REDIS_CONNECT_TIMEOUT = env('REDIS_CONNECT_TIMEOUT', default=0.5, cast=float)
+# once Redis fails, skip it for this many seconds instead of paying the
+# timeout on every request
+REDIS_RETRY_AFTER = env('REDIS_RETRY_AFTER', default=5, cast=float)
+
+CACHE_TTL = env('CACHE_TTL', default=86400, cast=int)
+# pages live under their namespace's generation, and every write to the
+# namespace leaves the previous generation's pages behind until they expire,
+# so they get a much shorter TTL than entries overwritten in place
+CACHE_PAGE_TTL = env('CACHE_PAGE_TTL', default=600, cast=int)
+LOCAL_CACHE_SIZE = env('LOCAL_CACHE_SIZE', default=1024, cast=int)
+# upper bound on how long a worker can serve a stale entry if it misses an
+# invalidation message, e.g. while its pub/sub connection is reconnecting
+LOCAL_CACHE_TTL = env('LOCAL_CACHE_TTL', default=60, cast=float)
+INVALIDATION_CHANNEL = 'cache:invalidate'
+# how long an entry may still be served, while one worker rebuilds it, after
+# its TTL has passed
+CACHE_STALE_TTL = env('CACHE_STALE_TTL', default=300, cast=int)
+# XFetch beta, higher values start refreshing hot entries earlier
+CACHE_EARLY_REFRESH_BETA = env('CACHE_EARLY_REFRESH_BETA', default=1.0, cast=float)
+CACHE_LOCK_TTL = env('CACHE_LOCK_TTL', default=10, cast=float)
+# how long a worker waits for another worker's rebuild before doing it itself
+CACHE_LOCK_WAIT = env('CACHE_LOCK_WAIT', default=2, cast=float)
+# how long a write keeps rebuilds that started before it from storing their
+# result, longer than any rebuild takes
+CACHE_WRITE_MARKER_TTL = env('CACHE_WRITE_MARKER_TTL', default=60, cast=int)
+
+REDIS_ERRORS = (RedisError, OSError, asyncio.TimeoutError)
+
+rd: redis.Redis | None = None
+
+
+class LocalCache:
+    # Per-worker LRU in front of Redis. Entries are evicted when another
+    # worker publishes an invalidation for their key, see listen().
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        # bumped on every eviction so a value read from Redis before an
+        # invalidation arrived is not stored after it, see set()
+        self.epoch = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value, epoch: int | None = None) -> None:
+        if epoch is not None and epoch != self.epoch:
+            return
+
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def evict(self, keys: Iterable[str]) -> None:
+        self.epoch += 1
+        for key in keys:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.epoch += 1
+        self.entries.clear()
+
+
+class RedisHealth:
+    # Circuit breaker around Redis. While it is open every cache call is a
+    # miss or a no-op and requests are served from the database. Writes that
+    # could not be invalidated are remembered and replayed on recovery so
+    # entries cached before the outage don't outlive it.
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        self.down_until = 0.0
+        self.pending_namespaces: set[str] = set()
+        self.pending_drops: set[str] = set()
+
+    @property
+    def available(self) -> bool:
+        return rd is not None and time.monotonic() >= self.down_until
+
+    def failed(self, error: Exception) -> None:
+        REDIS_ERRORS_TOTAL.inc()
+        if time.monotonic() >= self.down_until:
+            logger.warning('Redis unavailable, serving from the database: %r', error)
+        self.down_until = time.monotonic() + self.retry_after
+
+
+local_cache = LocalCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+health = RedisHealth(REDIS_RETRY_AFTER)
+
+async def connect_redis(socket_timeout: float = REDIS_SOCKET_TIMEOUT) -> None:
+    global rd
+    pool = redis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    )
+    rd = redis.Redis(connection_pool=pool)
+
+async def close_redis() -> None:
+    global rd
+    if rd is not None:
+        await rd.aclose()
+        rd = None
+
+async def cache_get(key: str) -> bytes | None:
+    value = local_cache.get(key)
+    if value is not None or not health.available:
+        return value
+
+    epoch = local_cache.epoch
+    try:
+        with REDIS_SECONDS.labels('get').time():
+            value = await rd.get(key)
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return None
+
+    if value is not None:
+        local_cache.set(key, value, epoch)
+
+    return value
+
+async def cache_get_many(keys: list[str]) -> list[bytes | None]:
+    # the local cache first, then one MGET for whatever it doesn't hold
+    values = [local_cache.get(key) for key in keys]
+    missing = [key for key, value in zip(keys, values) if value is None]
+    if not missing or not health.available:
+        return values
+
+    epoch = local_cache.epoch
+    try:
+        with REDIS_SECONDS.labels('mget').time():
+            fetched = dict(zip(missing, await rd.mget(missing)))
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return values
+
+    for key, value in fetched.items():
+        if value is not None:
+            local_cache.set(key, value, epoch)
+
+    return [fetched[key] if value is None else value for key, value in zip(keys, values)]
+
+# Cached values are stored under keys that embed the current generation of
+# their namespace, e.g. recipes:meal_type:dinner:v3. Invalidating a namespace
+# is a single INCR of its generation counter, after which readers build keys
+# for the new generation and the old entries simply age out via their TTL.
+
+def generation_key(namespace: str) -> str:
+    return f'generation:{namespace}'
+
+async def generation(namespace: str) -> int:
+    key = generation_key(namespace)
+
+    value = local_cache.get(key)
+    if value is not None or not health.available:
+        return value or 0
+
+    epoch = local_cache.epoch
+    try:
+        value = int(await rd.get(key) or 0)
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return 0
+
+    local_cache.set(key, value, epoch)
+    return value
+
+async def versioned_key(namespace: str, *parts) -> str:
+    return ':'.join([namespace, f'v{await generation(namespace)}', *map(str, parts)])
+
+async def invalidate(
+    namespaces: Iterable[str],
+    put: dict[str, str | bytes] | None = None,
+    drop: Iterable[str] = ()
+) -> None:
+    namespaces = set(namespaces) | health.pending_namespaces
+    drop = set(drop) | health.pending_drops
+    put = put or {}
+
+    evicted = [generation_key(namespace) for namespace in namespaces]
+    evicted.extend(put)
+    evicted.extend(drop)
+    local_cache.evict(evicted)
+
+    for family in {*namespaces, *map(key_family, put), *map(key_family, drop)}:
+        CACHE_INVALIDATIONS.labels(family).inc()
+
+    if not health.available:
+        # a write-through value can't be stored now, so make sure the stale
+        # entry is dropped instead once Redis is back
+        health.pending_namespaces = namespaces
+        health.pending_drops = drop | set(put)
+        return
+
+    pipe = rd.pipeline(transaction=False)
+
+    for namespace in namespaces:
+        pipe.incr(generation_key(namespace))
+
+    for key, value in put.items():
+        pipe.setex(key, CACHE_TTL + CACHE_STALE_TTL, pack(value, CACHE_TTL))
+
+    for key in {*put, *drop}:
+        pipe.incr(marker_key(key))
+        pipe.expire(marker_key(key), CACHE_WRITE_MARKER_TTL)
+
+    if replicas.replicas:
+        # rebuilds of what changed read the primary until the replicas
+        # have the write
+        for subject in {*namespaces, *put, *drop}:
+            pipe.set(recent_write_key(subject), 1, px=int(DB_READ_YOUR_WRITES_WINDOW * 1000))
+
+    if drop:
+        pipe.delete(*drop)
+
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps(evicted))
+
+    try:
+        with REDIS_SECONDS.labels('invalidate').time():
+            await pipe.execute()
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        health.pending_namespaces = namespaces
+        health.pending_drops = drop | set(put)
+        return
+
+    health.pending_namespaces = set()
+    health.pending_drops = set()
+
+async def flush_pending() -> None:
+    # invalidations that failed while Redis was down, replayed as soon as it
+    # is reachable again rather than with the next write
+    if (health.pending_namespaces or health.pending_drops) and health.available:
+        await invalidate(())
+
+# With read replicas configured, a write records what it changed for
+# DB_READ_YOUR_WRITES_WINDOW: the writer, see app.utils.auth, and the cache
+# namespaces and keys it invalidated. Reads about a recent subject go to the
+# primary, everything else keeps using the replicas.
+
+def recent_write_key(subject: str) -> str:
+    return f'wrote:{subject}'
+
+async def mark_written(*subjects: str) -> None:
+    if not replicas.replicas or not health.available:
+        return
+
+    pipe = rd.pipeline(transaction=False)
+    for subject in subjects:
+        pipe.set(recent_write_key(subject), 1, px=int(DB_READ_YOUR_WRITES_WINDOW * 1000))
+
+    try:
+        with REDIS_SECONDS.labels('mark_written').time():
+            await pipe.execute()
+    except REDIS_ERRORS as e:
+        health.failed(e)
+
+async def written_recently(*subjects: str) -> bool:
+    if not replicas.replicas:
+        return False
+    if not health.available:
+        # can't tell, the primary is always current
+        return True
+
+    try:
+        with REDIS_SECONDS.labels('written_recently').time():
+            return any(await rd.mget([recent_write_key(subject) for subject in subjects]))
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return True
+
+async def listen() -> None:
+    # Every worker, including the publisher, evicts the keys named in an
+    # invalidation message from its local cache. Runs for the lifetime of
+    # the app and resubscribes whenever the connection drops.
+    while True:
+        try:
+            async with rd.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # anything cached before the subscription was live may have
+                # missed an invalidation
+                local_cache.clear()
+
+                while True:
+                    await flush_pending()
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        local_cache.evict(json.loads(message['data']))
+        except REDIS_ERRORS as e:
+            health.failed(e)
+            await asyncio.sleep(REDIS_RETRY_AFTER)
+
+# Entries read through cached() carry a small header in front of the payload:
+# the wall clock time the entry goes stale, how long it took to compute, and
+# a digest of the payload, the ETag for conditional requests. Redis keeps them CACHE_STALE_TTL past their expiry so
+# a stale copy can be served while a single worker rebuilds it. The leading
+# version byte makes entries written in an older layout read as misses.
+
+ENVELOPE_VERSION = 3
+HEADER = struct.Struct('!Bdd16s')
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# A rebuild reads the database some time before it stores the result, and a
+# write in between would be overwritten with the old value. invalidate()
+# bumps a marker for every key it writes or drops; a rebuild reads the marker
+# before computing and only stores if it is unchanged.
+# KEYS[1] entry, KEYS[2] its marker, ARGV value, ttl, the marker as read
+# before computing ('' when there was none)
+STORE_IF_UNWRITTEN = """
+if (redis.call('get', KEYS[2]) or '') ~= ARGV[3] then
+    return 0
+end
+redis.call('setex', KEYS[1], ARGV[2], ARGV[1])
+return 1
+"""
+
+
+class CacheEntry(NamedTuple):
+    payload: bytes
+    etag: str
+
+
+_inflight: dict[str, asyncio.Task] = {}
+
+def pack(payload: str | bytes, ttl: int, delta: float = 0.0) -> bytes:
+    if isinstance(payload, str):
+        payload = payload.encode()
+    digest = hashlib.blake2b(payload, digest_size=16).digest()
+    return HEADER.pack(ENVELOPE_VERSION, time.time() + ttl, delta, digest) + payload
+
+def unpack(raw: bytes) -> tuple[float, float, CacheEntry] | None:
+    if len(raw) < HEADER.size or raw[0] != ENVELOPE_VERSION:
+        return None
+
+    _, expires_at, delta, digest = HEADER.unpack_from(raw)
+    return expires_at, delta, CacheEntry(raw[HEADER.size:], f'"{digest.hex()}"')
+
+def should_refresh(expires_at: float, delta: float) -> bool:
+    # probabilistic early expiration (XFetch): the closer an entry is to
+    # expiring and the longer it takes to rebuild, the more likely a reader
+    # is to refresh it ahead of time, so hot keys rarely expire at all
+    early = delta * CACHE_EARLY_REFRESH_BETA * -math.log(1.0 - random.random())
+    return time.time() + early >= expires_at
+
+def marker_key(key: str) -> str:
+    return f'written:{key}'
+
+async def write_markers(keys: list[str]) -> list[bytes | None]:
+    if not keys or not health.available:
+        return [None] * len(keys)
+
+    try:
+        with REDIS_SECONDS.labels('mget').time():
+            return await rd.mget([marker_key(key) for key in keys])
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return [None] * len(keys)
+
+async def store_unless_written(values: dict[str, bytes], markers: dict[str, bytes | None], ttl: int) -> None:
+    if not values or not health.available:
+        return
+
+    pipe = rd.pipeline(transaction=False)
+    for key, value in values.items():
+        pipe.eval(STORE_IF_UNWRITTEN, 2, key, marker_key(key), value, ttl, markers[key] or b'')
+
+    epoch = local_cache.epoch
+    try:
+        with REDIS_SECONDS.labels('store').time():
+            stored = await pipe.execute()
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return
+
+    for (key, value), ok in zip(values.items(), stored):
+        if ok:
+            local_cache.set(key, value, epoch)
+
+async def _store(key: str, compute: Callable[[], Awaitable[str | bytes]], ttl: int) -> CacheEntry:
+    marker, = await write_markers([key])
+    if await written_recently(key, key_family(key)):
+        # runs in its own task, see _single_flight()
+        replicas.use_primary()
+
+    start = time.perf_counter()
+    payload = await compute()
+
+    delta = time.perf_counter() - start
+    CACHE_REBUILD_SECONDS.labels(key_family(key)).observe(delta)
+
+    raw = pack(payload, ttl, delta)
+    await store_unless_written({key: raw}, {key: marker}, ttl + CACHE_STALE_TTL)
+    return unpack(raw)[2]
+
+async def _rebuild(key: str, compute: Callable[[], Awaitable[str | bytes]], ttl: int) -> CacheEntry:
+    if not health.available:
+        return await _store(key, compute, ttl)
+
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+
+    try:
+        acquired = await rd.set(lock_key, token, nx=True, px=int(CACHE_LOCK_TTL * 1000))
+    except REDIS_ERRORS as e:
+        health.failed(e)
+        return await _store(key, compute, ttl)
+
+    if acquired:
+        try:
+            return await _store(key, compute, ttl)
+        finally:
+            try:
+                await rd.eval(RELEASE_LOCK, 1, lock_key, token)
+            except REDIS_ERRORS as e:
+                health.failed(e)
+
+    # another worker is rebuilding, wait for its result before giving up and
+    # computing it here
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        raw = await cache_get(key)
+        unpacked = unpack(raw) if raw is not None else None
+        if unpacked is not None:
+            return unpacked[2]
+
+    return await _store(key, compute, ttl)
+
+def _single_flight(key: str, compute: Callable[[], Awaitable[str | bytes]], ttl: int) -> asyncio.Task:
+    # one rebuild per key per worker, concurrent callers share its result
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_rebuild(key, compute, ttl))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task
+
+def _log_refresh_error(task: asyncio.Task) -> None:
+    # nobody awaits a background refresh, the stale entry keeps being served
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning('Refreshing a cache entry failed: %r', task.exception())
+
+async def cached(
+    key: str,
+    compute: Callable[[], Awaitable[str | bytes]],
+    ttl: int = CACHE_TTL
+) -> CacheEntry:
+    """Return the entry cached under key, computing it on a miss.
+
+    compute must not depend on request scoped state such as the request's
+    database session, it may run in the background after the request that
+    triggered it has finished.
+    """
+    raw = await cache_get(key)
+    unpacked = unpack(raw) if raw is not None else None
+    family = key_family(key)
+
+    if unpacked is not None:
+        expires_at, delta, entry = unpacked
+
+        if should_refresh(expires_at, delta):
+            CACHE_REQUESTS.labels(family, 'refresh').inc()
+            _single_flight(key, compute, ttl).add_done_callback(_log_refresh_error)
+        else:
+            CACHE_REQUESTS.labels(family, 'hit').inc()
+
+        return entry
+
+    CACHE_REQUESTS.labels(family, 'miss').inc()
+    return await asyncio.shield(_single_flight(key, compute, ttl))
+
+async def cached_many(
+    keys: dict,
+    compute: Callable[[list], Awaitable[dict]],
+    ttl: int = CACHE_TTL
+) -> dict:
+    """Batch form of cached() for entries keyed by id, {id: key}.
+
+    Every key is read with one MGET, then compute is called once with the ids
+    whose entries are missing or due for a refresh and returns {id: payload}
+    for those it found. The results are written back in one pipeline. Ids
+    compute leaves out are missing from the result and aren't cached. Misses
+    are neither locked nor shared between concurrent callers, the batch is
+    rebuilt with a single query anyway.
+    """
+    entries, stale = {}, []
+
+    for (id, key), raw in zip(keys.items(), await cache_get_many(list(keys.values()))):
+        unpacked = unpack(raw) if raw is not None else None
+        family = key_family(key)
+
+        if unpacked is None:
+            CACHE_REQUESTS.labels(family, 'miss').inc()
+            stale.append(id)
+        elif should_refresh(*unpacked[:2]):
+            CACHE_REQUESTS.labels(family, 'refresh').inc()
+            stale.append(id)
+        else:
+            CACHE_REQUESTS.labels(family, 'hit').inc()
+            entries[id] = unpacked[2]
+
+    if not stale:
+        return entries
+
+    stale_keys = [keys[id] for id in stale]
+    markers = dict(zip(stale_keys, await write_markers(stale_keys)))
+
+    primary = await written_recently(*stale_keys, *{key_family(key) for key in stale_keys})
+
+    start = time.perf_counter()
+    if primary:
+        with replicas.on_primary():
+            payloads = await compute(stale)
+    else:
+        payloads = await compute(stale)
+    delta = time.perf_counter() - start
+
+    packed = {keys[id]: pack(payload, ttl, delta) for id, payload in payloads.items()}
+    for family in {key_family(key) for key in packed}:
+        CACHE_REBUILD_SECONDS.labels(family).observe(delta)
+    await store_unless_written(packed, markers, ttl + CACHE_STALE_TTL)
+
+    for id in payloads:
+        entries[id] = unpack(packed[keys[id]])[2]
+
+    return entries
@@ -0,0 +1,97 @@
+import re
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable
+
+from app.config.database import engine
+from app.helpers.enums import IngredientMatch
+from app.models.ingredient import Ingredient, recipe_ingredient
+from app.models.recipe import Recipe
+
+# Recipe.ingredients stays the free text the user wrote, the ingredient and
+# recipe_ingredient tables are derived from it on every write so recipes can
+# be looked up by ingredient through an index instead of a string scan.
+
+SEPARATORS = re.compile(r'[,;\n]')
+WHITESPACE = re.compile(r'\s+')
+NOTES = re.compile(r'\([^)]*\)')
+# "2 cups of", "1 1/2 tbsp", "250g", "3-4" ahead of the ingredient itself
+QUANTITY = re.compile(
+    r'^(?:[\d\u00bc-\u00be\u2150-\u215e]+(?:[./-]\d+)?\s*)+'
+    r'(?:(?:cups?|tbsps?|tablespoons?|tsps?|teaspoons?|g|grams?|kg|kilograms?|mg|ml|millilit(?:er|re)s?'
+    r'|l|lit(?:er|re)s?|oz|ounces?|lbs?|pounds?|pinch(?:es)?|cloves?|cans?|tins?|slices?|pieces?'
+    r'|handfuls?|bunch(?:es)?|sticks?|dash(?:es)?)\b\.?\s*)*(?:of\s+)?'
+)
+
+# names upserted per statement, each row binds 4 parameters
+INGREDIENT_BATCH_SIZE = 1000
+
+UPSERTS = {
+    'postgresql': postgres_insert,
+    'sqlite': sqlite_insert,
+}
+
+def ingredient_names(text: str) -> list[str]:
+    # lowercased with quantities, units and notes in brackets removed, so
+    # "2 cups flour (sifted)" and "flour" are the same ingredient
+    names = (
+        QUANTITY.sub('', WHITESPACE.sub(' ', NOTES.sub(' ', part)).strip().lower()).strip()
+        for part in SEPARATORS.split(text)
+    )
+    return list(dict.fromkeys(name for name in names if name))
+
+async def ingredient_ids(session: AsyncSession, names: Iterable[str]) -> dict[str, object]:
+    names = sorted(set(names))
+    ids = {}
+
+    # a multi row VALUES binds every column of every row, chunked to stay
+    # under the 32767 parameters Postgres accepts in one statement
+    for start in range(0, len(names), INGREDIENT_BATCH_SIZE):
+        chunk = names[start:start + INGREDIENT_BATCH_SIZE]
+
+        await session.execute(
+            UPSERTS[engine.dialect.name](Ingredient)
+            .values([{'name': name} for name in chunk])
+            .on_conflict_do_nothing(index_elements=['name'])
+        )
+
+        rows = await session.execute(select(Ingredient.name, Ingredient.id).where(Ingredient.name.in_(chunk)))
+        ids.update(rows.all())
+
+    return ids
+
+async def sync_ingredients(session: AsyncSession, recipes: Iterable[Recipe]) -> None:
+    # replaces the ingredient links of every recipe given, in the caller's
+    # transaction, with one statement per step however many recipes there are
+    parsed = {recipe.id: ingredient_names(recipe.ingredients) for recipe in recipes}
+    if not parsed:
+        return
+
+    ids = await ingredient_ids(session, (name for names in parsed.values() for name in names))
+
+    await session.execute(delete(recipe_ingredient).where(recipe_ingredient.c.recipe_id.in_(list(parsed))))
+
+    links = [
+        {'recipe_id': recipe_id, 'ingredient_id': ids[name]}
+        for recipe_id, names in parsed.items() for name in names
+    ]
+    if links:
+        await session.execute(insert(recipe_ingredient), links)
+
+def containing(names: list[str], match: IngredientMatch):
+    # ids of the recipes linked to all or any of the named ingredients,
+    # answered from the ingredient name and recipe_ingredient primary key
+    # indexes without reading the recipes themselves
+    query = (
+        select(recipe_ingredient.c.recipe_id)
+        .join(Ingredient, Ingredient.id == recipe_ingredient.c.ingredient_id)
+        .where(Ingredient.name.in_(names))
+        .group_by(recipe_ingredient.c.recipe_id)
+    )
+
+    if match == IngredientMatch.all:
+        query = query.having(func.count() == len(names))
+
+    return query
@@ -1,40 +1,113 @@
+import asyncio, json, logging, random
+from fastapi import BackgroundTasks
 from pydantic import EmailStr
 
 from decouple import config as env
 from trycourier import Courier
 
-client = Courier(auth_token=env('COURIER_API_KEY'))
+from app.utils import cache
 
-def send_verification_email(email: EmailStr, username:str, token:str):
+logger = logging.getLogger(__name__)
+
+# 'courier' sends through Courier, 'stub' only records and logs the messages,
+# for local development and tests
+MAIL_TRANSPORT = env('MAIL_TRANSPORT', default='courier')
+MAIL_STREAM = 'mail:outbound'
+# approximate cap on undelivered messages kept in the stream
+MAIL_STREAM_MAXLEN = env('MAIL_STREAM_MAXLEN', default=100000, cast=int)
+MAIL_MAX_ATTEMPTS = env('MAIL_MAX_ATTEMPTS', default=5, cast=int)
+MAIL_SEND_TIMEOUT = env('MAIL_SEND_TIMEOUT', default=10.0, cast=float)
+# seconds before the first retry, doubled for every further attempt
+MAIL_RETRY_BASE = env('MAIL_RETRY_BASE', default=2.0, cast=float)
+MAIL_RETRY_MAX = env('MAIL_RETRY_MAX', default=300.0, cast=float)
+
+
+class CourierTransport:
+    def __init__(self):
+        self.client = Courier(auth_token=env('COURIER_API_KEY'))
+
+    async def send(self, message: dict) -> None:
+        # the Courier SDK is blocking, keep it off the event loop
+        await asyncio.to_thread(self.client.send_message, message=message)
+
+
+class StubTransport:
+    def __init__(self):
+        self.sent: list[dict] = []
+
+    async def send(self, message: dict) -> None:
+        self.sent.append(message)
+        logger.info('Stub mail to %s: %s', message['to']['email'], message['template'])
+
+
+MAIL_TRANSPORTS = {
+    'courier': CourierTransport,
+    'stub': StubTransport,
+}
+
+transport = MAIL_TRANSPORTS[MAIL_TRANSPORT]()
+
+def retry_delay(attempts: int) -> float:
+    # exponential backoff with full jitter, so a provider outage isn't
+    # followed by every queued message retrying at the same moment
+    return random.uniform(0, min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * 2 ** attempts))
+
+async def send_now(message: dict) -> None:
+    # in-process delivery for when the queue is unavailable, with the same
+    # retry policy as the worker but nothing survives a restart
+    for attempt in range(MAIL_MAX_ATTEMPTS):
+        try:
+            return await asyncio.wait_for(transport.send(message), MAIL_SEND_TIMEOUT)
+        except Exception as e:
+            logger.warning('Mail to %s failed on attempt %d: %r', message['to']['email'], attempt + 1, e)
+            if attempt + 1 < MAIL_MAX_ATTEMPTS:
+                await asyncio.sleep(retry_delay(attempt))
+
+    logger.error('Giving up on mail to %s', message['to']['email'])
+
+async def enqueue(message: dict, background_tasks: BackgroundTasks) -> None:
+    # queued messages are delivered by the mail worker (python -m
+    # app.workers.mail). Without Redis they are sent from this process after
+    # the response, as before the queue existed.
+    if cache.health.available:
+        try:
+            await cache.rd.xadd(
+                MAIL_STREAM,
+                {'entry': json.dumps({'message': message, 'attempts': 0})},
+                maxlen=MAIL_STREAM_MAXLEN,
+                approximate=True
+            )
+            return
+        except cache.REDIS_ERRORS as e:
+            cache.health.failed(e)
+
+    background_tasks.add_task(send_now, message)
+
+def template_message(email: EmailStr, username: str, template: str, link: str) -> dict:
+    return {
+        "to": {
+        "email": email,
+        },
+        "template": template,
+        "data": {
+        "appName": "Flava",
+        "firstName": username,
+        "link": link,
+        },
+    }
+
+async def send_verification_email(background_tasks: BackgroundTasks, email: EmailStr, username:str, token:str):
     verification_link = f"{env('VERIFICATION_LINK')}?token={token}"
 
-    client.send_message(
-        message={
-            "to": {
-            "email": email,
-            },
-            "template": env('VERIFICATION_MAIL_TEMPLATE_ID'),
-            "data": {
-            "appName": "Flava",
-            "firstName": username,
-            "link": verification_link,
-            },
-        }
+    await enqueue(
+        template_message(email, username, env('VERIFICATION_MAIL_TEMPLATE_ID'), verification_link),
+        background_tasks
     )
 
-def send_password_reset_email(email: EmailStr, username:str, token:str):
+async def send_password_reset_email(background_tasks: BackgroundTasks, email: EmailStr, username:str, token:str):
     password_reset_link = f"{env('PASSWORD_RESET_LINK')}?token={token}"
 
-    client.send_message(
-        message={
-            "to": {
-            "email": email,
-            },
-            "template": env('PASSWORD_RESET_MAIL_TEMPLATE_ID'),
-            "data": {
-            "appName": "Flava",
-            "firstName": username,
-            "link": password_reset_link,
-            },
-        }
-    )
\ No newline at end of file
+    await enqueue(
+        template_message(email, username, env('PASSWORD_RESET_MAIL_TEMPLATE_ID'), password_reset_link),
+        background_tasks
+    )
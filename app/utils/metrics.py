@@ -0,0 +1,120 @@
+import os, re, time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Prometheus metrics served on /metrics. With several worker processes set
+# PROMETHEUS_MULTIPROC_DIR so every scrape aggregates all of them.
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['method', 'route', 'status']
+)
+DB_QUERY_SECONDS = Histogram('db_query_duration_seconds', 'Latency of single database queries')
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'Database queries issued while serving a request',
+    ['method', 'route'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    'db_time_per_request_seconds', 'Time spent in the database while serving a request',
+    ['method', 'route']
+)
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cached lookups by key family', ['family', 'result'])
+CACHE_REBUILD_SECONDS = Histogram(
+    'cache_rebuild_duration_seconds', 'Time to compute a cache entry', ['family']
+)
+CACHE_INVALIDATIONS = Counter('cache_invalidations_total', 'Invalidated key families', ['family'])
+REDIS_SECONDS = Histogram(
+    'redis_command_duration_seconds', 'Latency of cache Redis commands', ['command'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+)
+REDIS_ERRORS_TOTAL = Counter('redis_errors_total', 'Failed cache Redis calls')
+RATE_LIMITED = Counter('rate_limited_total', 'Requests rejected by a rate limit', ['limit'])
+PASSWORD_HASH_SECONDS = Histogram(
+    'password_hash_duration_seconds', 'bcrypt time per operation, excluding the wait for a thread',
+    ['operation'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+VERSION = re.compile(r'v\d+')
+UNMATCHED = 'unmatched'
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+def key_family(key: str) -> str:
+    # recipes:meal_type:dinner:v3:20:first -> recipes:meal_type:dinner,
+    # recipe:<id> -> recipe, so the label never carries ids or cursors
+    parts = key.split(':')
+    for index, part in enumerate(parts):
+        if VERSION.fullmatch(part):
+            return ':'.join(parts[:index])
+    return parts[0]
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.query_started
+        DB_QUERY_SECONDS.observe(elapsed)
+
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware, which would run every request
+    # in an extra task.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router fills in the matched route, label by its template so
+            # ids in the path don't become label values
+            route = scope.get('route')
+            route = route.path if route is not None else UNMATCHED
+
+            REQUEST_SECONDS.labels(scope['method'], route, status).observe(time.perf_counter() - start)
+            DB_QUERIES_PER_REQUEST.labels(scope['method'], route).observe(stats.queries)
+            DB_SECONDS_PER_REQUEST.labels(scope['method'], route).observe(stats.db_seconds)
+            request_stats.reset(token)
+
+def latest_metrics() -> tuple[bytes, str]:
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,57 @@
+import asyncio
+from collections import Counter
+from decouple import config as env
+from typing import Iterable
+
+from app.utils import cache
+from app.utils.metrics import REDIS_SECONDS
+
+# Reads per recipe, kept in a sorted set so the cache warm-up knows which
+# recipes are worth computing ahead of traffic. Each worker counts in memory
+# and adds its counts to Redis every POPULARITY_FLUSH_INTERVAL seconds, so
+# tracking costs one pipeline per interval rather than a command per read.
+
+POPULAR_RECIPES = 'recipes:popular'
+POPULARITY_FLUSH_INTERVAL = env('POPULARITY_FLUSH_INTERVAL', default=10.0, cast=float)
+# recipes kept in the set, the least read beyond this are dropped
+POPULARITY_TRACKED = env('POPULARITY_TRACKED', default=10000, cast=int)
+
+counts: Counter = Counter()
+
+def record(ids: Iterable) -> None:
+    counts.update(str(id) for id in ids)
+
+async def flush() -> None:
+    global counts
+    if not counts or not cache.health.available:
+        return
+
+    pending, counts = counts, Counter()
+    pipe = cache.rd.pipeline(transaction=False)
+    for id, count in pending.items():
+        pipe.zincrby(POPULAR_RECIPES, count, id)
+    pipe.zremrangebyrank(POPULAR_RECIPES, 0, -POPULARITY_TRACKED - 1)
+
+    try:
+        with REDIS_SECONDS.labels('popularity').time():
+            await pipe.execute()
+    except cache.REDIS_ERRORS as e:
+        cache.health.failed(e)
+        # try again with the next flush
+        counts.update(pending)
+
+async def run() -> None:
+    # runs for the lifetime of the app
+    while True:
+        await asyncio.sleep(POPULARITY_FLUSH_INTERVAL)
+        await flush()
+
+async def most_read(limit: int) -> list[str]:
+    if not cache.health.available:
+        return []
+
+    try:
+        return [id.decode() for id in await cache.rd.zrevrange(POPULAR_RECIPES, 0, limit - 1)]
+    except cache.REDIS_ERRORS as e:
+        cache.health.failed(e)
+        return []
@@ -0,0 +1,289 @@
+import math, time, uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from decouple import config as env
+from fastapi import HTTPException, Request, Response, status
+from fastapi.exception_handlers import http_exception_handler
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from typing import Awaitable, Callable
+
+from app.utils import cache
+from app.utils.metrics import RATE_LIMITED
+
+# Limits are checked in Redis so they hold across workers, with one atomic
+# script per check. While Redis is unavailable each worker enforces them on
+# its own from memory, which is also what runs in tests without Redis.
+
+RATE_LIMIT_ENABLED = env('RATE_LIMIT_ENABLED', default=True, cast=bool)
+# reverse proxies in front of the app. Each appends the address it got the
+# request from to X-Forwarded-For, so the client is the one added by the
+# outermost, this many from the right; whatever is left of it came from the
+# client and can't be trusted. 0 ignores the header
+RATE_LIMIT_TRUSTED_PROXIES = env('RATE_LIMIT_TRUSTED_PROXIES', default=0, cast=int)
+# most clients a worker tracks in memory while Redis is down
+RATE_LIMIT_LOCAL_SIZE = env('RATE_LIMIT_LOCAL_SIZE', default=10000, cast=int)
+
+TOKEN_BUCKET = 'token_bucket'
+SLIDING_WINDOW = 'sliding_window'
+
+# KEYS[1] bucket, ARGV capacity, refill per second, now
+# returns allowed, tokens left, seconds until the next token
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('pexpire', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens), tostring((1 - math.min(tokens, 1)) / rate)}
+"""
+
+# KEYS[1] window, ARGV limit, window seconds, now, request id
+# returns allowed, requests left, seconds until the oldest request expires
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+redis.call('zremrangebyscore', KEYS[1], '-inf', now - window)
+local count = redis.call('zcard', KEYS[1])
+local allowed = 0
+if count < limit then
+    redis.call('zadd', KEYS[1], now, ARGV[4])
+    count = count + 1
+    allowed = 1
+end
+redis.call('pexpire', KEYS[1], math.ceil(window * 1000))
+local oldest = redis.call('zrange', KEYS[1], 0, 0, 'WITHSCORES')
+local reset = 0
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed, tostring(limit - count), tostring(reset)}
+"""
+
+# KEYS[1] bucket, ARGV capacity; gives back the token a request took
+TOKEN_BUCKET_REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('hget', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('hset', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + 1)))
+end
+return 0
+"""
+
+
+@dataclass
+class RateLimit:
+    limit: int
+    period: float
+    algorithm: str = TOKEN_BUCKET
+
+    @classmethod
+    def parse(cls, spec: str, algorithm: str = TOKEN_BUCKET) -> 'RateLimit':
+        # "5/60" is 5 requests per 60 seconds
+        limit, period = spec.split('/')
+        return cls(int(limit), float(period), algorithm)
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    remaining: int
+    reset: float
+    # what the request added to a sliding window, so refund() can take it out
+    member: str | float | None = None
+    local: bool = False
+
+
+class LocalRateLimiter:
+    # Same algorithms as the scripts above, kept per worker.
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.state: OrderedDict[str, object] = OrderedDict()
+
+    def get(self, key: str, default):
+        value = self.state.pop(key, default)
+        self.state[key] = value
+
+        while len(self.state) > self.maxsize:
+            self.state.popitem(last=False)
+
+        return value
+
+    def token_bucket(self, key: str, limit: RateLimit, now: float) -> Decision:
+        rate = limit.limit / limit.period
+        tokens, ts = self.get(key, [limit.limit, now])
+        tokens = min(limit.limit, tokens + max(0.0, now - ts) * rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self.state[key] = [tokens, now]
+        return Decision(allowed, int(tokens), (1 - min(tokens, 1)) / rate, local=True)
+
+    def sliding_window(self, key: str, limit: RateLimit, now: float) -> Decision:
+        requests = self.get(key, deque())
+        while requests and requests[0] <= now - limit.period:
+            requests.popleft()
+
+        allowed = len(requests) < limit.limit
+        if allowed:
+            requests.append(now)
+
+        reset = requests[0] + limit.period - now if requests else 0.0
+        return Decision(allowed, limit.limit - len(requests), reset, now, local=True)
+
+    def check(self, key: str, limit: RateLimit, now: float) -> Decision:
+        if limit.algorithm == SLIDING_WINDOW:
+            return self.sliding_window(key, limit, now)
+        return self.token_bucket(key, limit, now)
+
+    def refund(self, key: str, limit: RateLimit, decision: Decision) -> None:
+        state = self.state.get(key)
+        if state is None:
+            return
+
+        if limit.algorithm == SLIDING_WINDOW:
+            if decision.member in state:
+                state.remove(decision.member)
+        else:
+            state[0] = min(limit.limit, state[0] + 1)
+
+
+local_limiter = LocalRateLimiter(RATE_LIMIT_LOCAL_SIZE)
+
+async def check(key: str, limit: RateLimit) -> Decision:
+    now = time.time()
+
+    if cache.health.available:
+        member = uuid.uuid4().hex
+        try:
+            if limit.algorithm == SLIDING_WINDOW:
+                result = await cache.rd.eval(
+                    SLIDING_WINDOW_SCRIPT, 1, key, limit.limit, limit.period, now, member
+                )
+            else:
+                result = await cache.rd.eval(
+                    TOKEN_BUCKET_SCRIPT, 1, key, limit.limit, limit.limit / limit.period, now
+                )
+            allowed, remaining, reset = result
+            return Decision(bool(allowed), int(float(remaining)), float(reset), member)
+        except cache.REDIS_ERRORS as e:
+            cache.health.failed(e)
+
+    return local_limiter.check(key, limit, now)
+
+async def refund(key: str, limit: RateLimit, decision: Decision) -> None:
+    # gives back what an allowed request took from its budget
+    if decision.local:
+        local_limiter.refund(key, limit, decision)
+        return
+    if not cache.health.available:
+        return
+
+    try:
+        if limit.algorithm == SLIDING_WINDOW:
+            await cache.rd.zrem(key, decision.member)
+        else:
+            await cache.rd.eval(TOKEN_BUCKET_REFUND_SCRIPT, 1, key, limit.limit)
+    except cache.REDIS_ERRORS as e:
+        cache.health.failed(e)
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUSTED_PROXIES:
+        forwarded = [
+            address.strip()
+            for header in request.headers.getlist('x-forwarded-for')
+            for address in header.split(',')
+            if address.strip()
+        ]
+        # shorter when the request didn't come through every proxy
+        if len(forwarded) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return forwarded[-RATE_LIMIT_TRUSTED_PROXIES]
+    return request.client.host if request.client else 'unknown'
+
+async def by_ip(request: Request) -> str:
+    return f'ip:{client_ip(request)}'
+
+async def by_account(request: Request) -> str:
+    # the email in the JSON body, so attempts against one account are limited
+    # however many addresses they come from. FastAPI has already parsed the
+    # body, this reads its cached copy.
+    try:
+        body = await request.json()
+        email = body.get('email') if isinstance(body, dict) else None
+    except ValueError:
+        email = None
+    return f'account:{email.strip().lower()}' if isinstance(email, str) else await by_ip(request)
+
+def rate_limit(
+    name: str,
+    limit: RateLimit,
+    key: Callable[[Request], Awaitable[str]] = by_ip
+) -> Callable[[Request, Response], Awaitable[None]]:
+    """Dependency rejecting a client with 429 once it used up its budget.
+
+    Every response carries X-RateLimit-Limit, -Remaining and -Reset for the
+    tightest limit on the route. The budget is taken before the handler
+    runs, a handler that decides the request shouldn't count gives it back
+    with refund_limit().
+    """
+    async def dependency(request: Request, response: Response) -> None:
+        if not RATE_LIMIT_ENABLED:
+            return
+
+        bucket = f'ratelimit:{name}:{await key(request)}'
+        decision = await check(bucket, limit)
+        reset = str(math.ceil(decision.reset))
+
+        if not decision.allowed:
+            RATE_LIMITED.labels(name).inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many requests, try again later',
+                headers={
+                    'Retry-After': reset,
+                    'X-RateLimit-Limit': str(limit.limit),
+                    'X-RateLimit-Remaining': '0',
+                    'X-RateLimit-Reset': reset,
+                }
+            )
+
+        if not hasattr(request.state, 'rate_limits'):
+            request.state.rate_limits = {}
+        request.state.rate_limits[name] = (bucket, limit, decision)
+
+        # kept on the request too, the injected response is dropped when the
+        # handler raises, see rate_limited_http_exception()
+        current = getattr(request.state, 'rate_limit_headers', None)
+        if current is None or decision.remaining < int(current['X-RateLimit-Remaining']):
+            request.state.rate_limit_headers = {
+                'X-RateLimit-Limit': str(limit.limit),
+                'X-RateLimit-Remaining': str(decision.remaining),
+                'X-RateLimit-Reset': reset,
+            }
+            response.headers.update(request.state.rate_limit_headers)
+
+    return dependency
+
+async def rate_limited_http_exception(request: Request, exc: StarletteHTTPException) -> Response:
+    """Exception handler adding the X-RateLimit headers to error responses."""
+    response = await http_exception_handler(request, exc)
+    for name, value in getattr(request.state, 'rate_limit_headers', {}).items():
+        response.headers.setdefault(name, value)
+    return response
+
+async def refund_limit(request: Request, name: str) -> None:
+    """Give back what this request took from the budget of rate_limit(name)."""
+    spent = getattr(request.state, 'rate_limits', {}).pop(name, None)
+    if spent is not None:
+        await refund(*spent)
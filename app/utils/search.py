@@ -0,0 +1,181 @@
+import abc, bisect, difflib, re
+from collections import defaultdict
+from decouple import config as env
+from typing import Sequence
+from uuid import UUID
+
+from sqlalchemy import ColumnElement, func, literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.database import engine
+from app.helpers.pagination import decode_rank_cursor, encode_rank_cursor
+from app.models.recipe import Recipe
+
+SEARCH_CONFIG = 'english'
+# every column, searches return rows rather than Recipe objects; pass fewer
+# to select only what the response needs, id is always required
+RECIPE_COLUMNS = tuple(Recipe.__table__.columns)
+
+
+class SearchBackend(abc.ABC):
+    # load, index and remove are for backends that keep their own index
+
+    @abc.abstractmethod
+    async def search(
+        self, session: AsyncSession, query: str, cursor: str | None, limit: int,
+        columns: Sequence[ColumnElement] = RECIPE_COLUMNS
+    ) -> tuple[list, str | None]:
+        ...
+
+    async def load(self, session: AsyncSession) -> None:
+        pass
+
+    def index(self, recipe: Recipe) -> None:
+        pass
+
+    def remove(self, id: UUID) -> None:
+        pass
+
+
+class PostgresSearchBackend(SearchBackend):
+    # search_vector is a stored generated column (see the search migration),
+    # so Postgres keeps it current on every write and index/remove are no-ops
+    search_vector = literal_column('recipe.search_vector', TSVECTOR)
+
+    def statement(
+        self, query: str, cursor: str | None, limit: int, columns: Sequence[ColumnElement] = RECIPE_COLUMNS
+    ):
+        ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        rank = func.ts_rank_cd(self.search_vector, ts_query) + func.similarity(Recipe.name, query)
+
+        statement = (
+            select(*columns, rank.label('rank'))
+            .where(self.search_vector.bool_op('@@')(ts_query) | Recipe.name.bool_op('%')(query))
+            .order_by(rank.desc(), Recipe.id.desc())
+            .limit(limit + 1)
+        )
+
+        if cursor:
+            statement = statement.where(tuple_(rank, Recipe.id) < decode_rank_cursor(cursor))
+
+        return statement
+
+    async def search(self, session, query, cursor, limit, columns=RECIPE_COLUMNS):
+        rows = (await session.execute(self.statement(query, cursor, limit, columns))).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].id)
+
+        return rows, next_cursor
+
+
+TOKEN = re.compile(r'\w+')
+NAME_WEIGHT = 3.0
+BODY_WEIGHT = 1.0
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+
+class InMemorySearchBackend(SearchBackend):
+    # Inverted index kept in process for databases without full-text search
+    # (SQLite in local tests). Each worker builds its own copy at startup and
+    # only sees the writes it handles itself, so it is not meant for
+    # multi-worker deployments.
+
+    def __init__(self):
+        self.postings: dict[str, dict[UUID, float]] = defaultdict(dict)
+        self.documents: dict[UUID, set[str]] = {}
+        self.vocabulary: list[str] = []
+
+    async def load(self, session):
+        for recipe in (await session.scalars(select(Recipe))).all():
+            self.index(recipe)
+
+    def index(self, recipe):
+        self.remove(recipe.id)
+
+        weights = defaultdict(float)
+        for token in tokenize(recipe.name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(f'{recipe.description} {recipe.ingredients}'):
+            weights[token] += BODY_WEIGHT
+
+        for token, weight in weights.items():
+            if token not in self.postings:
+                bisect.insort(self.vocabulary, token)
+            self.postings[token][recipe.id] = weight
+
+        self.documents[recipe.id] = set(weights)
+
+    def remove(self, id):
+        for token in self.documents.pop(id, ()):
+            postings = self.postings[token]
+            postings.pop(id, None)
+
+            if not postings:
+                del self.postings[token]
+                self.vocabulary.pop(bisect.bisect_left(self.vocabulary, token))
+
+    def expand(self, term: str) -> list[str]:
+        # prefix matches first, falling back to close spellings for typos
+        start = bisect.bisect_left(self.vocabulary, term)
+        matches = []
+        for token in self.vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            matches.append(token)
+
+        return matches or difflib.get_close_matches(term, self.vocabulary, n=3, cutoff=0.8)
+
+    def score(self, query: str) -> dict[UUID, float]:
+        scores = None
+
+        for term in set(tokenize(query)):
+            term_scores = defaultdict(float)
+            for token in self.expand(term):
+                for id, weight in self.postings[token].items():
+                    term_scores[id] += weight
+
+            # every term has to match, like websearch_to_tsquery
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {id: scores[id] + term_scores[id] for id in scores.keys() & term_scores.keys()}
+
+        return scores or {}
+
+    async def search(self, session, query, cursor, limit, columns=RECIPE_COLUMNS):
+        ranked = sorted(
+            ((rank, id) for id, rank in self.score(query).items()),
+            reverse=True
+        )
+
+        if cursor:
+            after = decode_rank_cursor(cursor)
+            ranked = [entry for entry in ranked if entry < after]
+
+        page = ranked[:limit]
+        next_cursor = encode_rank_cursor(*page[-1]) if len(ranked) > limit else None
+
+        ids = [id for _, id in page]
+        recipes = {
+            row.id: row
+            for row in (await session.execute(select(*columns).where(Recipe.id.in_(ids)))).all()
+        }
+
+        return [recipes[id] for id in ids if id in recipes], next_cursor
+
+
+SEARCH_BACKENDS = {
+    'postgres': PostgresSearchBackend,
+    'memory': InMemorySearchBackend,
+}
+
+def default_backend() -> str:
+    return 'postgres' if engine.dialect.name == 'postgresql' else 'memory'
+
+search_backend: SearchBackend = SEARCH_BACKENDS[env('SEARCH_BACKEND', default=default_backend())]()
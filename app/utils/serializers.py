@@ -0,0 +1,87 @@
+import csv, io, orjson
+from fastapi import Request, Response, status
+from typing import Iterable
+
+from app.models.recipe import Recipe
+from app.utils.cache import CacheEntry
+
+# Recipe payloads are encoded once, cached as bytes and written straight to
+# the response body, so a cache hit is never decoded or re-validated.
+
+RECIPE_FIELDS = (
+    "id", "name", "description", "ingredients", "instructions",
+    "servings", "meal_type", "created_at", "updated_at",
+)
+# what the list views show, selected with fields=summary
+SUMMARY_FIELDS = ("id", "name", "description", "meal_type")
+
+def recipe_dict(recipe: Recipe, fields: Iterable[str] = RECIPE_FIELDS) -> dict:
+    # recipe may also be a row selected with only some of the columns
+    return {field: getattr(recipe, field) for field in fields}
+
+def encode_recipe(recipe: Recipe) -> bytes:
+    return orjson.dumps(recipe_dict(recipe))
+
+def encode_page(
+    recipes: Iterable[Recipe], next_cursor: str | None, fields: Iterable[str] = RECIPE_FIELDS
+) -> bytes:
+    return orjson.dumps({
+        "items": [recipe_dict(recipe, fields) for recipe in recipes],
+        "next_cursor": next_cursor,
+    })
+
+def encode_bulk(recipes: Iterable[Recipe], errors: list[dict]) -> bytes:
+    return orjson.dumps({
+        "items": [recipe_dict(recipe) for recipe in recipes],
+        "errors": errors,
+    })
+
+def encode_batch(payloads: Iterable[bytes], missing: list) -> bytes:
+    # the recipes are already encoded, splice them in rather than decoding
+    return b'{"items":[' + b','.join(payloads) + b'],"missing":' + orjson.dumps(missing) + b'}'
+
+def encode_ndjson(recipes: Iterable[Recipe]) -> bytes:
+    return b''.join(orjson.dumps(recipe_dict(recipe)) + b'\n' for recipe in recipes)
+
+def encode_csv(recipes: Iterable[Recipe], header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if header:
+        writer.writerow(RECIPE_FIELDS)
+
+    for recipe in recipes:
+        row = recipe_dict(recipe)
+        row["meal_type"] = row["meal_type"].value
+        row["created_at"] = row["created_at"].isoformat()
+        row["updated_at"] = row["updated_at"].isoformat()
+        writer.writerow(row[field] for field in RECIPE_FIELDS)
+
+    return buffer.getvalue().encode()
+
+def json_response(payload: bytes, status_code: int = status.HTTP_200_OK) -> Response:
+    return Response(content=payload, status_code=status_code, media_type='application/json')
+
+def not_modified(request: Request, entry: CacheEntry) -> bool:
+    # ETags only. HTTP dates have second precision, so a Last-Modified can't
+    # tell apart two versions written within the same second
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+
+    # compares weakly
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or entry.etag in tags
+
+def cached_response(request: Request, entry: CacheEntry) -> Response:
+    # clients keep the body and revalidate it on every use, a 304 costs no
+    # body and no serialization
+    headers = {
+        'ETag': entry.etag,
+        'Cache-Control': 'private, no-cache',
+    }
+
+    if not_modified(request, entry):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=entry.payload, media_type='application/json', headers=headers)
@@ -0,0 +1,174 @@
+import asyncio, json, logging, os, socket, time
+from decouple import config as env
+from redis.exceptions import ResponseError
+
+from app.utils import cache
+from app.utils.cache import REDIS_ERRORS, REDIS_RETRY_AFTER, REDIS_SOCKET_TIMEOUT, close_redis, connect_redis
+from app.utils.mail import (
+    MAIL_MAX_ATTEMPTS, MAIL_SEND_TIMEOUT, MAIL_STREAM, MAIL_STREAM_MAXLEN, retry_delay, transport
+)
+
+# Drains the outbound mail stream filled by app.utils.mail.enqueue. Run any
+# number of these next to the API, they share the stream through a consumer
+# group:
+#
+#     python -m app.workers.mail
+#
+# A message is only acknowledged once it was sent, rescheduled for a retry or
+# dead-lettered, in one transaction, so a worker that dies mid-batch loses
+# nothing: another worker claims its unacknowledged messages after
+# MAIL_CLAIM_IDLE seconds.
+
+logger = logging.getLogger(__name__)
+
+MAIL_GROUP = 'mailers'
+MAIL_RETRY_QUEUE = 'mail:retry'
+MAIL_DEAD_LETTER = 'mail:dead'
+MAIL_BATCH_SIZE = env('MAIL_BATCH_SIZE', default=50, cast=int)
+# most messages handed to the transport at once, per worker
+MAIL_CONCURRENCY = env('MAIL_CONCURRENCY', default=10, cast=int)
+MAIL_CLAIM_IDLE = env('MAIL_CLAIM_IDLE', default=60, cast=float)
+# also the longest a due retry waits to be put back on the stream
+MAIL_POLL_INTERVAL = env('MAIL_POLL_INTERVAL', default=1.0, cast=float)
+
+CONSUMER = f'{socket.gethostname()}-{os.getpid()}'
+
+# moves the retries that are due back onto the stream, atomically so a retry
+# is neither lost nor sent twice when several workers promote at once
+PROMOTE_DUE = """
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, entry in ipairs(due) do
+    redis.call('zrem', KEYS[1], entry)
+    redis.call('xadd', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'entry', entry)
+end
+return #due
+"""
+
+
+async def create_group() -> None:
+    try:
+        await cache.rd.xgroup_create(MAIL_STREAM, MAIL_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+async def read_batch() -> list:
+    # messages another worker read but never acknowledged come first
+    _, claimed, *_ = await cache.rd.xautoclaim(
+        MAIL_STREAM, MAIL_GROUP, CONSUMER,
+        min_idle_time=int(MAIL_CLAIM_IDLE * 1000),
+        count=MAIL_BATCH_SIZE
+    )
+    if claimed:
+        return claimed
+
+    response = await cache.rd.xreadgroup(
+        MAIL_GROUP, CONSUMER, {MAIL_STREAM: '>'},
+        count=MAIL_BATCH_SIZE,
+        block=int(MAIL_POLL_INTERVAL * 1000)
+    )
+    return response[0][1] if response else []
+
+async def deliver(entry: dict, semaphore: asyncio.Semaphore) -> Exception | None:
+    async with semaphore:
+        try:
+            await asyncio.wait_for(transport.send(entry['message']), MAIL_SEND_TIMEOUT)
+        except Exception as e:
+            return e
+
+def decode(fields: dict) -> dict | None:
+    try:
+        entry = json.loads(fields[b'entry'])
+        entry['message']['to']['email'], int(entry['attempts'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return entry
+
+async def handle(batch: list, semaphore: asyncio.Semaphore) -> None:
+    decoded, malformed = [], []
+    for id, fields in batch:
+        # claimed messages deleted in the meantime come back without fields
+        if not fields:
+            continue
+        entry = decode(fields)
+        if entry is None:
+            malformed.append((id, fields))
+        else:
+            decoded.append((id, entry))
+
+    batch = decoded
+    errors = await asyncio.gather(*(deliver(entry, semaphore) for _, entry in batch))
+
+    pipe = cache.rd.pipeline(transaction=True)
+
+    # an entry that can't be read would end the worker, and come back first
+    # after every restart, so it goes straight to the dead letters as it is
+    for id, fields in malformed:
+        logger.error('Dead-lettering malformed mail entry %s', id.decode())
+        pipe.xadd(
+            MAIL_DEAD_LETTER, {**fields, b'error': b'malformed entry'},
+            maxlen=MAIL_STREAM_MAXLEN, approximate=True
+        )
+        pipe.xack(MAIL_STREAM, MAIL_GROUP, id)
+        pipe.xdel(MAIL_STREAM, id)
+
+    for (id, entry), error in zip(batch, errors):
+        if error is not None:
+            attempts = entry['attempts'] + 1
+            email = entry['message']['to']['email']
+
+            if attempts < MAIL_MAX_ATTEMPTS:
+                logger.warning('Mail to %s failed on attempt %d, retrying: %r', email, attempts, error)
+                # the stream id keeps identical messages apart in the set
+                retry = json.dumps({**entry, 'attempts': attempts, 'id': id.decode()})
+                pipe.zadd(MAIL_RETRY_QUEUE, {retry: time.time() + retry_delay(attempts - 1)})
+            else:
+                logger.error('Giving up on mail to %s after %d attempts: %r', email, attempts, error)
+                dead = json.dumps({**entry, 'attempts': attempts, 'error': repr(error)})
+                pipe.xadd(MAIL_DEAD_LETTER, {'entry': dead}, maxlen=MAIL_STREAM_MAXLEN, approximate=True)
+
+        pipe.xack(MAIL_STREAM, MAIL_GROUP, id)
+        pipe.xdel(MAIL_STREAM, id)
+
+    await pipe.execute()
+
+    sent = errors.count(None)
+    if sent:
+        logger.info('Sent %d of %d mails', sent, len(batch))
+
+async def run() -> None:
+    # XREADGROUP blocks for MAIL_POLL_INTERVAL, the API's socket timeout
+    # would cut every idle poll short with a TimeoutError
+    await connect_redis(socket_timeout=MAIL_POLL_INTERVAL + REDIS_SOCKET_TIMEOUT)
+    semaphore = asyncio.Semaphore(MAIL_CONCURRENCY)
+    group_created = False
+    logger.info('Mail worker %s started', CONSUMER)
+
+    try:
+        while True:
+            try:
+                if not group_created:
+                    await create_group()
+                    group_created = True
+
+                await cache.rd.eval(
+                    PROMOTE_DUE, 2, MAIL_RETRY_QUEUE, MAIL_STREAM,
+                    time.time(), MAIL_BATCH_SIZE, MAIL_STREAM_MAXLEN
+                )
+
+                batch = await read_batch()
+                if batch:
+                    await handle(batch, semaphore)
+            except REDIS_ERRORS as e:
+                logger.warning('Redis unavailable, retrying in %ss: %r', REDIS_RETRY_AFTER, e)
+                await asyncio.sleep(REDIS_RETRY_AFTER)
+    finally:
+        await close_redis()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
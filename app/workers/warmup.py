@@ -0,0 +1,99 @@
+import argparse, asyncio, logging, time
+from decouple import config as env
+from fastapi import HTTPException
+from uuid import UUID
+
+from app.helpers.enums import MealType
+from app.helpers.pagination import DEFAULT_PAGE_SIZE
+from app.routers.recipe import BATCH_MAX_IDS, load_recipes, meal_type_page, recipe_key, recipes_page
+from app.utils import cache, popularity
+from app.utils.cache import cached_many, close_redis, connect_redis
+from app.utils.serializers import RECIPE_FIELDS, SUMMARY_FIELDS
+
+# Fills the cache with what the first requests after a deploy or a Redis
+# flush would otherwise all compute at once: the first page of the listing
+# and of every meal type filter, in full and summary form, and the most read
+# recipes. Entries that are already cached are left alone. Runs from the app
+# lifespan, see WARMUP_ON_STARTUP, or on its own:
+#
+#     python -m app.workers.warmup --top 500
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_STARTUP = env('WARMUP_ON_STARTUP', default=True, cast=bool)
+# most read recipes to cache
+WARMUP_TOP_RECIPES = env('WARMUP_TOP_RECIPES', default=200, cast=int)
+# cache entries computed at once, keep it well below the database pool size
+WARMUP_CONCURRENCY = env('WARMUP_CONCURRENCY', default=4, cast=int)
+# the longest startup waits for the warm-up, the rest is left to traffic
+WARMUP_TIMEOUT = env('WARMUP_TIMEOUT', default=30.0, cast=float)
+
+PROJECTIONS = (RECIPE_FIELDS, SUMMARY_FIELDS)
+
+
+async def warm(top: int = WARMUP_TOP_RECIPES, concurrency: int = WARMUP_CONCURRENCY) -> int:
+    """Cache the warm-up entries that are missing, returning how many are cached."""
+    if not cache.health.available:
+        logger.warning('Redis unavailable, skipping the cache warm-up')
+        return 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(job) -> int:
+        async with semaphore:
+            try:
+                return await job
+            except HTTPException:
+                # nothing to cache, e.g. a meal type without recipes
+                return 0
+
+    async def page(build) -> int:
+        await build
+        return 1
+
+    async def recipes(ids: list[UUID]) -> int:
+        return len(await cached_many({id: recipe_key(id) for id in ids}, load_recipes))
+
+    jobs = []
+    for fields in PROJECTIONS:
+        jobs.append(page(recipes_page(None, DEFAULT_PAGE_SIZE, fields)))
+        jobs.extend(page(meal_type_page(type, None, DEFAULT_PAGE_SIZE, fields)) for type in MealType)
+
+    ids = [UUID(id) for id in await popularity.most_read(top)]
+    jobs.extend(recipes(ids[start:start + BATCH_MAX_IDS]) for start in range(0, len(ids), BATCH_MAX_IDS))
+
+    return sum(await asyncio.gather(*(bounded(job) for job in jobs)))
+
+async def warm_on_startup() -> None:
+    if not WARMUP_ON_STARTUP:
+        return
+
+    start = time.perf_counter()
+    try:
+        entries = await asyncio.wait_for(warm(), WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning('Cache warm-up did not finish within %ss, continuing', WARMUP_TIMEOUT)
+        return
+    except Exception:
+        # a cold cache is slow, not broken, never fail startup over it
+        logger.exception('Cache warm-up failed, continuing')
+        return
+
+    logger.info('%d cache entries warm after %.2fs', entries, time.perf_counter() - start)
+
+async def run(args) -> None:
+    await connect_redis()
+    try:
+        start = time.perf_counter()
+        entries = await warm(args.top, args.concurrency)
+        logger.info('%d cache entries warm after %.2fs', entries, time.perf_counter() - start)
+    finally:
+        await close_redis()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    parser = argparse.ArgumentParser(description='Fill the recipe cache ahead of traffic')
+    parser.add_argument('--top', type=int, default=WARMUP_TOP_RECIPES, help='most read recipes to cache')
+    parser.add_argument('--concurrency', type=int, default=WARMUP_CONCURRENCY)
+    asyncio.run(run(parser.parse_args()))
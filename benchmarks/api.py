@@ -0,0 +1,309 @@
+"""Load test the recipe and user endpoints through the ASGI app.
+
+Seeds --recipes synthetic recipes into the database configured by DB_URI
+(pass --recipes 0 when it is already seeded), starts the app in process with
+an in-memory fake Redis (or the one at REDIS_URL with --real-redis) and
+drives each endpoint with httpx at --concurrency for --rounds rounds,
+reporting the median throughput, latency percentiles and database queries
+per request. Mail is sent with the stub transport and rate limits are off.
+
+    pip install -r requirements-dev.txt
+    python -m benchmarks.api --fresh --recipes 10000 --save-baseline baseline.json
+    python -m benchmarks.api --fresh --recipes 10000 --compare baseline.json
+
+--fresh empties every table first, point DB_URI at a scratch database. A
+baseline records the recipe count, request count, concurrency, rounds,
+database and host it ran with, and --compare refuses a run made with
+different ones. It exits non-zero when an endpoint's throughput drops, or its p95 grows, by more than
+--threshold percent, or it fails more requests than in the baseline.
+"""
+import os
+
+os.environ.setdefault('MAIL_TRANSPORT', 'stub')
+# every login comes from one client and account, the limits would reject most
+os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import fakeredis
+import httpx
+from prometheus_client import REGISTRY
+from sqlalchemy import event, func, select
+
+import app.main as api
+from app.config.database import Base, SessionLocal, engine, init_db
+from app.models.recipe import Recipe
+from app.utils import cache
+from app.utils.ingredients import sync_ingredients
+from benchmarks.search import WORDS, seed
+
+PASSWORD = 'correct horse battery staple'
+# how long SQLite waits for its single write lock, concurrent creates queue
+# for it longer than the driver's default 5 seconds
+SQLITE_BUSY_TIMEOUT_MS = 60_000
+SEED_LINK_BATCH = 1000
+
+
+class Scenario:
+    def __init__(self, name: str, method: str, route: str, request):
+        self.name = name
+        self.method = method
+        # the route template the app labels its metrics with
+        self.route = route
+        self.request = request
+
+
+def db_queries(method: str, route: str) -> tuple[float, float]:
+    labels = {'method': method, 'route': route}
+    return (
+        REGISTRY.get_sample_value('db_queries_per_request_sum', labels) or 0.0,
+        REGISTRY.get_sample_value('db_queries_per_request_count', labels) or 0.0,
+    )
+
+def percentile(samples: list[float], p: int) -> float:
+    return statistics.quantiles(samples, n=100)[p - 1] if len(samples) > 1 else samples[0]
+
+async def measure(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(index: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(scenario.method, **scenario.request(index))
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before, count_before = db_queries(scenario.method, scenario.route)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - start
+    queries_after, count_after = db_queries(scenario.method, scenario.route)
+
+    return {
+        'rps': requests / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'queries': (queries_after - queries_before) / max(count_after - count_before, 1),
+        'errors': errors,
+    }
+
+async def empty_tables() -> None:
+    async with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(table.delete())
+
+async def seed_ingredients() -> None:
+    # benchmarks.search.seed writes recipe rows only
+    async with SessionLocal() as session:
+        last = None
+        while True:
+            query = select(Recipe).order_by(Recipe.id).limit(SEED_LINK_BATCH)
+            if last is not None:
+                query = query.where(Recipe.id > last)
+
+            recipes = (await session.scalars(query)).all()
+            if not recipes:
+                break
+
+            await sync_ingredients(session, recipes)
+            await session.commit()
+            last = recipes[-1].id
+
+async def authenticate(client: httpx.AsyncClient) -> dict:
+    username = f'bench-{uuid.uuid4().hex[:12]}'
+    email = f'{username}@example.com'
+
+    await client.post('/users/', json={
+        'name': 'Benchmark', 'email': email, 'username': username, 'password': PASSWORD
+    })
+    response = await client.post('/users/login', json={'email': email, 'password': PASSWORD})
+    response.raise_for_status()
+
+    return {'email': email, 'headers': {'Authorization': f"Bearer {response.json()['access_token']}"}}
+
+def scenarios(user: dict, ids: list, cursor: str | None, args) -> list[Scenario]:
+    headers = user['headers']
+    rng = random.Random(7)
+
+    def recipe(index):
+        return {
+            'name': f'Benchmark {index}', 'description': ' '.join(rng.choices(WORDS, k=12)),
+            'ingredients': ', '.join(rng.sample(WORDS, 8)), 'instructions': ' '.join(rng.choices(WORDS, k=40)),
+            'servings': '4', 'meal_type': 'dinner',
+        }
+
+    return [
+        Scenario('list', 'GET', '/recipes/', lambda i: {'url': '/recipes/', 'headers': headers}),
+        Scenario('list, next page', 'GET', '/recipes/', lambda i: {
+            'url': '/recipes/', 'params': {'cursor': cursor}, 'headers': headers
+        }),
+        Scenario('filter', 'GET', '/recipes/filter', lambda i: {
+            'url': '/recipes/filter', 'params': {'type': ['breakfast', 'lunch', 'dinner', 'dessert'][i % 4]},
+            'headers': headers
+        }),
+        Scenario('search', 'GET', '/recipes/search', lambda i: {
+            'url': '/recipes/search', 'params': {'name': rng.choice(WORDS)}, 'headers': headers
+        }),
+        Scenario('containing', 'GET', '/recipes/containing', lambda i: {
+            'url': '/recipes/containing', 'params': {'ingredients': ','.join(rng.sample(WORDS, 2)), 'match': 'any'},
+            'headers': headers
+        }),
+        Scenario('detail', 'GET', '/recipes/{id}', lambda i: {
+            'url': f'/recipes/{rng.choice(ids)}', 'headers': headers
+        }),
+        Scenario('batch', 'GET', '/recipes/batch', lambda i: {
+            'url': '/recipes/batch', 'params': {'ids': ','.join(map(str, rng.sample(ids, 20)))}, 'headers': headers
+        }),
+        Scenario('create', 'POST', '/recipes/', lambda i: {
+            'url': '/recipes/', 'json': recipe(i), 'headers': headers
+        }),
+        # bcrypt bound, run at a fraction of the requests
+        Scenario('login', 'POST', '/users/login', lambda i: {
+            'url': '/users/login', 'json': {'email': user['email'], 'password': PASSWORD}
+        }),
+    ]
+
+def report(results: dict, baseline: dict | None, threshold: float) -> list[str]:
+    regressions = []
+
+    header = f"{'endpoint':<18}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'errors':>8}"
+    if baseline:
+        header += f"{'rps vs base':>13}{'p95 vs base':>13}"
+    print(header)
+
+    for name, result in results.items():
+        line = (
+            f"{name:<18}{result['rps']:>10.1f}{result['p50']:>10.2f}{result['p95']:>10.2f}"
+            f"{result['p99']:>10.2f}{result['queries']:>9.2f}{result['errors']:>8}"
+        )
+
+        base = (baseline or {}).get(name)
+        if base:
+            rps_change = (result['rps'] / base['rps'] - 1) * 100
+            p95_change = (result['p95'] / base['p95'] - 1) * 100
+            line += f"{rps_change:>+12.1f}%{p95_change:>+12.1f}%"
+
+            if rps_change < -threshold or p95_change > threshold or result['errors'] > base['errors']:
+                regressions.append(name)
+
+        print(line)
+
+    return regressions
+
+async def main(args) -> int:
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine.sync_engine, 'connect')
+        def busy_timeout(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+            cursor.close()
+
+    await init_db()
+    if args.fresh:
+        await empty_tables()
+    if args.recipes:
+        await seed(args.recipes)
+        await seed_ingredients()
+
+    if not args.real_redis:
+        async def connect_fake_redis():
+            cache.rd = fakeredis.FakeAsyncRedis()
+        api.connect_redis = connect_fake_redis
+
+    async with SessionLocal() as session:
+        ids = (await session.scalars(select(Recipe.id).limit(10_000))).all()
+        recipes = await session.scalar(select(func.count()).select_from(Recipe))
+    if not ids:
+        print('no recipes to benchmark, seed some with --recipes')
+        return 1
+
+    params = {
+        'recipes': recipes,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'warmup': args.warmup,
+        'rounds': args.rounds,
+        'dialect': engine.dialect.name,
+        # latencies are only comparable on the machine that recorded them
+        'host': platform.node(),
+    }
+    baseline = None
+    if args.compare:
+        if not os.path.exists(args.compare):
+            print(f'no baseline at {args.compare}, record one with --save-baseline')
+            await engine.dispose()
+            return 2
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"baseline was recorded with {baseline.get('params')}, this run has {params}")
+            await engine.dispose()
+            return 2
+
+    results = {}
+    async with api.app.router.lifespan_context(api.app):
+        # a request the app fails, e.g. SQLite giving up on a locked database
+        # under concurrent writes, counts as an error instead of ending the run
+        transport = httpx.ASGITransport(app=api.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+            user = await authenticate(client)
+            first_page = await client.get('/recipes/', headers=user['headers'])
+            cursor = first_page.json()['next_cursor']
+
+            for scenario in scenarios(user, ids, cursor, args):
+                requests = args.requests if scenario.name != 'login' else max(args.requests // 10, 1)
+
+                # fill the caches first so reads are measured in steady state
+                await measure(client, scenario, min(args.warmup, requests), args.concurrency)
+                # the median of a few rounds, one slow round on a busy machine
+                # is not a regression
+                rounds = [await measure(client, scenario, requests, args.concurrency) for _ in range(args.rounds)]
+                results[scenario.name] = {
+                    key: statistics.median(run[key] for run in rounds) for key in rounds[0]
+                }
+                results[scenario.name]['errors'] = max(run['errors'] for run in rounds)
+
+    await engine.dispose()
+
+    print(
+        f'{args.requests} requests per endpoint at concurrency {args.concurrency}, '
+        f'{recipes} recipes, {engine.dialect.name}'
+    )
+    regressions = report(results, baseline['results'] if baseline else None, args.threshold)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+
+    if regressions:
+        print(f"regressed by more than {args.threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=10_000, help='recipes to seed, 0 to skip')
+    parser.add_argument('--fresh', action='store_true', help='empty every table before seeding')
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=3, help='measured rounds per endpoint, the median is reported')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per endpoint')
+    parser.add_argument('--real-redis', action='store_true', help='use REDIS_URL instead of a fake Redis')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--threshold', type=float, default=25.0, help='allowed regression, in percent')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,98 @@
+"""Compare request throughput of the sync and async database engines.
+
+Runs the same slow query from many concurrent "handlers" on one event loop,
+first through a sync Session (the old ``get_db``) and then through an
+AsyncSession, and reports throughput and the worst event loop stall.
+
+    python -m benchmarks.db_concurrency --concurrency 50 --requests 500
+"""
+import argparse
+import asyncio
+import time
+
+from decouple import config
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.config.database import async_database_uri
+
+SLOW_QUERY = text(
+    'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :n) '
+    'SELECT count(*) FROM c'
+)
+
+
+async def watch_loop(stop: asyncio.Event, interval: float = 0.005) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(handler, requests: int, concurrency: int) -> dict:
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stop))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    return {
+        'elapsed': elapsed,
+        'rps': requests / elapsed,
+        'max_loop_stall_ms': await watcher * 1000,
+    }
+
+
+async def main(args):
+    params = {'n': args.rows}
+    # sqlite engines don't pool connections, every other backend gets a
+    # pool large enough that checkout never becomes the bottleneck
+    pool = {} if args.db_uri.startswith('sqlite') else {'pool_size': args.concurrency}
+
+    sync_engine = create_engine(args.db_uri, **pool)
+    SyncSession = sessionmaker(sync_engine)
+
+    async def sync_handler():
+        with SyncSession() as session:
+            session.execute(SLOW_QUERY, params).scalar()
+
+    async_engine = create_async_engine(async_database_uri(args.db_uri), **pool)
+    AsyncSession = async_sessionmaker(async_engine)
+
+    async def async_handler():
+        async with AsyncSession() as session:
+            (await session.execute(SLOW_QUERY, params)).scalar()
+
+    results = {
+        'sync Session': await run(sync_handler, args.requests, args.concurrency),
+        'AsyncSession': await run(async_handler, args.requests, args.concurrency),
+    }
+
+    sync_engine.dispose()
+    await async_engine.dispose()
+
+    print(f"{'engine':<14}{'elapsed (s)':>14}{'req/s':>12}{'max loop stall (ms)':>22}")
+    for name, result in results.items():
+        print(
+            f"{name:<14}{result['elapsed']:>14.2f}{result['rps']:>12.1f}"
+            f"{result['max_loop_stall_ms']:>22.1f}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db-uri', default=config('DB_URI'))
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=100_000, help='size of the slow query')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""Compare insert throughput of random and time ordered primary keys.
+
+Inserts --rows rows shaped like a recipe into scratch tables in the
+database configured by DB_URI, one transaction per --batch rows, for three
+layouts: random uuid4 keys with the duplicate unique id index the tables
+used to have, random keys on the primary key alone, and time ordered uuid7
+keys on the primary key alone. Reports rows per second and, on Postgres,
+the size of the indexes written and how full their leaf pages are.
+
+    python -m benchmarks.inserts --rows 1000000 --batch 100
+
+Random keys only fall behind once the index outgrows the buffer cache,
+size --rows accordingly.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table, UUID, exc, insert, text
+
+from app.config.database import engine
+from app.models.base import utcnow, uuid7
+
+PAYLOAD = 'x' * 200
+
+LAYOUTS = [
+    ('uuid4, pk + id index', uuid.uuid4, True),
+    ('uuid4, pk', uuid.uuid4, False),
+    ('uuid7, pk', uuid7, False),
+]
+
+# pgstattuple is optional, without it only the sizes are reported
+INDEX_STATS = text(
+    'SELECT c.relname, pg_relation_size(c.oid), '
+    '(SELECT avg_leaf_density FROM pgstatindex(c.oid::regclass)) '
+    'FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+    'WHERE i.indrelid = CAST(:table AS regclass)'
+)
+INDEX_SIZES = text(
+    'SELECT c.relname, pg_relation_size(c.oid), NULL '
+    'FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+    'WHERE i.indrelid = CAST(:table AS regclass)'
+)
+
+
+def scratch_table(index: int, duplicate_index: bool) -> Table:
+    table = Table(
+        f'bench_insert_{index}', MetaData(),
+        Column('id', UUID(as_uuid=True), primary_key=True),
+        Column('payload', String, nullable=False),
+        Column('created_at', DateTime(timezone=True), nullable=False),
+    )
+    if duplicate_index:
+        Index(f'ix_bench_insert_{index}_id', table.c.id, unique=True)
+    return table
+
+async def index_stats(conn, table: Table) -> list:
+    try:
+        async with conn.begin_nested():
+            return (await conn.execute(INDEX_STATS, {'table': table.name})).all()
+    except exc.DBAPIError:
+        return (await conn.execute(INDEX_SIZES, {'table': table.name})).all()
+
+async def run(table: Table, new_id, rows: int, batch: int) -> float:
+    async with engine.begin() as conn:
+        await conn.run_sync(table.drop, checkfirst=True)
+        await conn.run_sync(table.create)
+
+    start = time.perf_counter()
+    for offset in range(0, rows, batch):
+        async with engine.begin() as conn:
+            await conn.execute(insert(table), [
+                {'id': new_id(), 'payload': PAYLOAD, 'created_at': utcnow()}
+                for _ in range(min(batch, rows - offset))
+            ])
+
+    return rows / (time.perf_counter() - start)
+
+async def main(args):
+    postgres = engine.dialect.name == 'postgresql'
+
+    print(f"{'layout':<24}{'rows/s':>12}{'index MB':>12}{'leaf fill %':>13}")
+    for index, (name, new_id, duplicate_index) in enumerate(LAYOUTS):
+        table = scratch_table(index, duplicate_index)
+        rate = await run(table, new_id, args.rows, args.batch)
+
+        size, fill = '', ''
+        async with engine.begin() as conn:
+            if postgres:
+                stats = await index_stats(conn, table)
+                size = f'{sum(row[1] for row in stats) / 2 ** 20:.1f}'
+                densities = [row[2] for row in stats if row[2] is not None]
+                fill = f'{sum(densities) / len(densities):.0f}' if densities else ''
+
+            if not args.keep:
+                await conn.run_sync(table.drop)
+
+        print(f'{name:<24}{rate:>12.0f}{size:>12}{fill:>13}')
+
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--batch', type=int, default=100, help='rows per transaction')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch tables')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,46 @@
+"""Compare password verification throughput on and off the event loop.
+
+Verifies the same bcrypt hash from many concurrent "logins", first inline on
+the event loop (the old verify_password) and then through the hashing pool,
+and reports throughput and the worst event loop stall. Cost and pool size
+come from BCRYPT_ROUNDS and PASSWORD_HASH_WORKERS.
+
+    python -m benchmarks.login --concurrency 20 --requests 100
+"""
+import argparse
+import asyncio
+
+from app.utils.auth import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, pwd_content, verify_password
+from benchmarks.db_concurrency import run
+
+PASSWORD = 'correct horse battery staple'
+
+
+async def main(args):
+    hashed = pwd_content.hash(PASSWORD)
+
+    async def inline():
+        assert pwd_content.verify(PASSWORD, hashed)
+
+    async def pooled():
+        assert await verify_password(PASSWORD, hashed)
+
+    results = {
+        'inline': await run(inline, args.requests, args.concurrency),
+        'pooled': await run(pooled, args.requests, args.concurrency),
+    }
+
+    print(f'bcrypt cost {BCRYPT_ROUNDS}, {PASSWORD_HASH_WORKERS} hashing threads')
+    print(f"{'verify':<10}{'elapsed (s)':>14}{'logins/s':>12}{'max loop stall (ms)':>22}")
+    for name, result in results.items():
+        print(
+            f"{name:<10}{result['elapsed']:>14.2f}{result['rps']:>12.1f}"
+            f"{result['max_loop_stall_ms']:>22.1f}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""Check that the hot recipe queries are served from an index.
+
+Seeds --recipes synthetic recipes (pass --recipes 0 when the table is
+already populated), refreshes the planner statistics and prints the plan of
+every query the recipe router runs on a request path. Exits non-zero if any
+of them scans the recipe table sequentially, so it can gate a migration or a
+change to a router query. On Postgres the database must be migrated to head.
+
+    python -m benchmarks.query_plans --recipes 50000
+"""
+import argparse
+import asyncio
+import re
+import sys
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import select, text
+
+from app.config.database import engine, init_db
+from app.helpers.enums import IngredientMatch, MealType
+from app.helpers.pagination import DEFAULT_PAGE_SIZE, encode_cursor, paginate
+from app.models.base import utcnow
+from app.models.recipe import Recipe
+from app.routers.recipe import containing_query, export_query, meal_type_query, recipes_query
+from app.utils.search import PostgresSearchBackend
+from app.utils.serializers import RECIPE_FIELDS, SUMMARY_FIELDS
+from benchmarks.search import seed
+
+SEQUENTIAL_SCANS = {
+    'postgresql': re.compile(r'Seq Scan on recipe\b'),
+    # a bare SCAN reads the table, SCAN ... USING INDEX walks an index in order
+    'sqlite': re.compile(r'\bSCAN recipe\b(?! USING)'),
+}
+EXPLAIN = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def hot_queries() -> dict:
+    cursor = encode_cursor(utcnow(), uuid.uuid4())
+    ingredients = ['chicken', 'pepper']
+    queries = {
+        'list': paginate(recipes_query(RECIPE_FIELDS), None, DEFAULT_PAGE_SIZE),
+        'list, next page': paginate(recipes_query(RECIPE_FIELDS), cursor, DEFAULT_PAGE_SIZE),
+        'list, summary': paginate(recipes_query(SUMMARY_FIELDS), None, DEFAULT_PAGE_SIZE),
+        'filter': paginate(meal_type_query(MealType.dinner, RECIPE_FIELDS), None, DEFAULT_PAGE_SIZE),
+        'filter, next page': paginate(meal_type_query(MealType.dinner, RECIPE_FIELDS), cursor, DEFAULT_PAGE_SIZE),
+        'containing all': paginate(
+            containing_query(ingredients, IngredientMatch.all, RECIPE_FIELDS), None, DEFAULT_PAGE_SIZE
+        ),
+        'containing any, next page': paginate(
+            containing_query(ingredients, IngredientMatch.any, RECIPE_FIELDS), cursor, DEFAULT_PAGE_SIZE
+        ),
+        'detail': select(Recipe).where(Recipe.id == uuid.uuid4()),
+        'export since': export_query(utcnow() - timedelta(hours=1)),
+    }
+
+    if engine.dialect.name == 'postgresql':
+        backend = PostgresSearchBackend()
+        queries['search'] = backend.statement('spicy chicken stew', None, DEFAULT_PAGE_SIZE)
+
+    return queries
+
+
+async def main(args) -> int:
+    await init_db()
+    if args.recipes:
+        await seed(args.recipes)
+
+    dialect = engine.dialect.name
+    failed = []
+
+    async with engine.connect() as conn:
+        await conn.execute(text('ANALYZE'))
+
+        for name, query in hot_queries().items():
+            sql = str(query.compile(engine, compile_kwargs={'literal_binds': True}))
+            plan = '\n'.join(
+                ' '.join(map(str, row)) if dialect == 'sqlite' else row[0]
+                for row in (await conn.exec_driver_sql(EXPLAIN[dialect] + sql)).all()
+            )
+
+            scanned = SEQUENTIAL_SCANS[dialect].search(plan) is not None
+            if scanned:
+                failed.append(name)
+
+            print(f"{name} {'SEQUENTIAL SCAN' if scanned else 'ok'}")
+            print('    ' + plan.replace('\n', '\n    '))
+
+    await engine.dispose()
+
+    if failed:
+        print(f"sequential scans on hot paths: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=50_000, help='recipes to seed, 0 to skip')
+    sys.exit(asyncio.run(main(parser.parse_args())))
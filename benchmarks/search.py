@@ -0,0 +1,110 @@
+"""Measure recipe search latency against a large synthetic catalogue.
+
+Seeds --recipes synthetic recipes (pass --recipes 0 when the table is
+already populated) and times the old name ILIKE scan against the configured
+search backend for a fixed set of queries. On Postgres the database must be
+migrated to head so the tsvector column and indexes exist; on SQLite the
+in-process index is built first and its build time reported.
+
+    python -m benchmarks.search --recipes 1000000 --repeat 20
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import insert, select
+
+from app.config.database import SessionLocal, engine, init_db
+from app.helpers.enums import MealType
+from app.helpers.pagination import DEFAULT_PAGE_SIZE
+from app.models.base import utcnow, uuid7
+from app.models.recipe import Recipe
+from app.utils.search import InMemorySearchBackend, search_backend
+
+WORDS = (
+    'jollof rice tomato pepper onion chicken beef goat fish plantain yam cassava '
+    'okra spinach egusi palm oil ginger garlic thyme curry beans waakye banku kenkey '
+    'groundnut soup stew fried grilled roasted spicy sweet smoked coconut pineapple '
+    'mango pancake porridge oats bread butter cheese salad avocado lime honey'
+).split()
+
+QUERIES = ['jollof', 'spicy chicken stew', 'plantain', 'groundnut soup', 'coconut rice', 'jolof']
+
+
+def phrase(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choices(WORDS, k=words))
+
+
+async def seed(count: int, batch: int = 10_000):
+    rng = random.Random(42)
+    meal_types = list(MealType)
+
+    async with engine.begin() as conn:
+        for start in range(0, count, batch):
+            rows = [
+                {
+                    'id': uuid7(),
+                    'name': phrase(rng, 3).title(),
+                    'description': phrase(rng, 12),
+                    'ingredients': ', '.join(rng.sample(WORDS, 8)),
+                    'instructions': phrase(rng, 40),
+                    'servings': str(rng.randint(1, 8)),
+                    'meal_type': rng.choice(meal_types),
+                    'created_at': utcnow(),
+                    'updated_at': utcnow(),
+                }
+                for _ in range(min(batch, count - start))
+            ]
+            await conn.execute(insert(Recipe), rows)
+            print(f'seeded {start + len(rows)}/{count}', end='\r')
+    print()
+
+
+async def timed(fn, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main(args):
+    await init_db()
+    if args.recipes:
+        await seed(args.recipes)
+
+    async with SessionLocal() as session:
+        if isinstance(search_backend, InMemorySearchBackend):
+            start = time.perf_counter()
+            await search_backend.load(session)
+            print(f'in-memory index built in {time.perf_counter() - start:.1f}s')
+
+        print(f"{'query':<22}{'ilike p50':>12}{'ilike p95':>12}{'search p50':>12}{'search p95':>12}")
+        for query in QUERIES:
+            ilike = select(Recipe).where(Recipe.name.ilike(f'%{query}%')).limit(DEFAULT_PAGE_SIZE)
+
+            async def run_ilike():
+                (await session.scalars(ilike)).all()
+
+            async def run_search():
+                await search_backend.search(session, query, None, DEFAULT_PAGE_SIZE)
+
+            baseline = await timed(run_ilike, args.repeat)
+            searched = await timed(run_search, args.repeat)
+            print(
+                f'{query:<22}'
+                f'{statistics.median(baseline):>12.2f}{statistics.quantiles(baseline, n=20)[-1]:>12.2f}'
+                f'{statistics.median(searched):>12.2f}{statistics.quantiles(searched, n=20)[-1]:>12.2f}'
+            )
+
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=1_000_000, help='recipes to seed, 0 to skip')
+    parser.add_argument('--repeat', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))